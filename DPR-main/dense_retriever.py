@@ -9,9 +9,11 @@
  Command line tool to get dense results and validate them
 """
 
+import asyncio
 import glob
 import json
 import logging
+import os
 import pickle
 import time
 import zlib
@@ -29,6 +31,9 @@ from dpr.data.qa_validation import calculate_matches, calculate_chunked_matches,
 from dpr.data.retriever_data import KiltCsvCtxSrc, TableChunk
 from dpr.indexer.faiss_indexers import (
     DenseIndexer,
+    DenseHNSWFlatIndexer,
+    squared_norms,
+    stack_vectors,
 )
 from dpr.models import init_biencoder_components
 from dpr.models.biencoder import (
@@ -149,13 +154,19 @@ class LocalFaissRetriever(DenseRetriever):
         vector_files: List[str],
         buffer_size: int,
         path_id_prefixes: List = None,
+        stats_file: str = None,
     ):
         """
         Indexes encoded passages takes form a list of files
         :param vector_files: file names to get passages vectors from
         :param buffer_size: size of a buffer (amount of passages) to send for the indexing at once
+        :param stats_file: optional json file with precomputed max vector norm for HNSW indexes
         :return:
         """
+        if isinstance(self.index, DenseHNSWFlatIndexer) and not self.index.phi:
+            # HNSW indexes need the max norm of all vectors upfront; getting it in a first pass lets
+            # the vectors be added one buffer at a time instead of holding the whole corpus in memory
+            self.index.set_phi(compute_max_norm(vector_files, stats_file=stats_file))
         buffer = []
         for i, item in enumerate(iterate_encoded_files(vector_files, path_id_prefixes=path_id_prefixes)):
             buffer.append(item)
@@ -179,6 +190,105 @@ class LocalFaissRetriever(DenseRetriever):
         return results
 
 
+class CoalescingRetriever(object):
+    """
+    Online serving wrapper for LocalFaissRetriever. Concurrent single-question requests are collected for up to
+    max_wait_ms or max_batch questions, encoded in one question encoder forward pass and searched with one
+    index.search_knn call; each caller then gets its own results.
+    """
+
+    def __init__(
+        self,
+        retriever: LocalFaissRetriever,
+        max_batch: int = 32,
+        max_wait_ms: float = 5.0,
+        query_token: str = None,
+    ):
+        self.retriever = retriever
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.query_token = query_token
+        self._queue = None
+        self._worker = None
+        self._loop = None
+        self._batch = []
+
+    async def retrieve(self, question: str, top_docs: int = 100) -> Tuple[List[object], List[float]]:
+        """
+        Retrieves the best matching passages for one question, batched with other concurrent requests
+        :param question: question text
+        :param top_docs: amount of passages to return
+        :return: (passage ids, scores) as in LocalFaissRetriever.get_top_docs
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._loop is not loop:
+            # the queue and worker belong to one event loop; a new loop (e.g. a new asyncio.run) gets its own
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._batch = []
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((question, top_docs, future))
+        return await future
+
+    async def close(self):
+        """
+        Stops the batching worker; requests still queued or being searched fail with RuntimeError
+        """
+        worker, self._worker = self._worker, None
+        if worker is None:
+            return
+        worker.cancel()
+        if self._loop is asyncio.get_running_loop():
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        pending = self._batch
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        self._batch = []
+        for _, _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("CoalescingRetriever was closed"))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # encoding and search block, so they run off the event loop
+            try:
+                results = await loop.run_in_executor(None, self._search_batch, batch)
+                for (_, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self._batch = []
+
+    def _search_batch(self, batch) -> List[Tuple[List[object], List[float]]]:
+        questions = [question for question, _, _ in batch]
+        top_docs = max(k for _, k, _ in batch)
+        time0 = time.time()
+        query_vectors = self.retriever.generate_question_vectors(questions, query_token=self.query_token)
+        # not get_top_docs: it releases the index after a single offline search
+        results = self.retriever.index.search_knn(query_vectors.numpy(), top_docs)
+        logger.info("coalesced batch of %d questions served in %f sec.", len(batch), time.time() - time0)
+        return [(ids[:k], scores[:k]) for (ids, scores), (_, k, _) in zip(results, batch)]
+
+
 # works only with our distributed_faiss library
 class DenseRPCRetriever(DenseRetriever):
     def __init__(
@@ -436,6 +546,39 @@ def iterate_encoded_files(vector_files: list, path_id_prefixes: List = None) ->
                 yield doc
 
 
+def compute_max_norm(vector_files: List[str], stats_file: str = None) -> float:
+    """
+    Returns the max squared norm of the encoded passage vectors. It is read from stats_file when that file
+    exists and was computed over the same files (same names, sizes and modification times), otherwise computed
+    in a pass over the files (one file in memory at a time) and saved to stats_file.
+    """
+    files = [
+        {"file": file, "size": os.path.getsize(file), "mtime": os.path.getmtime(file)} for file in sorted(vector_files)
+    ]
+    if stats_file and os.path.isfile(stats_file):
+        with open(stats_file) as reader:
+            stats = json.load(reader)
+        if stats.get("files") == files:
+            logger.info("Max vector norm %f read from %s", stats["phi"], stats_file)
+            return stats["phi"]
+        logger.warning("Stats file %s was computed over other or modified files, recomputing", stats_file)
+
+    phi = 0.0
+    for file in vector_files:
+        logger.info("Computing max vector norm of %s", file)
+        with open(file, "rb") as reader:
+            doc_vectors = pickle.load(reader)
+        if len(doc_vectors):
+            phi = max(phi, float(squared_norms(stack_vectors(doc_vectors)).max()))
+        del doc_vectors
+    logger.info("Max vector norm %f", phi)
+
+    if stats_file:
+        with open(stats_file, "w") as writer:
+            json.dump({"phi": phi, "files": files}, writer)
+    return phi
+
+
 def validate_tables(
     passages: Dict[object, TableChunk],
     answers: List[List[str]],
@@ -553,7 +696,7 @@ def main(cfg: DictConfig):
         retriever.load_index(cfg.rpc_index_id)
     elif index_path and index.index_exists(index_path):
         logger.info("Index path: %s", index_path)
-        retriever.index.deserialize(index_path)
+        retriever.index.deserialize(index_path, mmap=cfg.index_mmap)
     else:
         # send data for indexing
         id_prefixes = []
@@ -588,7 +731,12 @@ def main(cfg: DictConfig):
             path_id_prefixes.extend([pattern_id_prefix] * len(pattern_files))
         logger.info("Embeddings files id prefixes: %s", path_id_prefixes)
         logger.info("Reading all passages data from files: %s", input_paths)
-        retriever.index_encoded_data(input_paths, index_buffer_sz, path_id_prefixes=path_id_prefixes)
+        if cfg.rpc_retriever_cfg_file:
+            retriever.index_encoded_data(input_paths, index_buffer_sz, path_id_prefixes=path_id_prefixes)
+        else:
+            retriever.index_encoded_data(
+                input_paths, index_buffer_sz, path_id_prefixes=path_id_prefixes, stats_file=cfg.index_stats_file
+            )
         if index_path:
             retriever.index.serialize(index_path)
 
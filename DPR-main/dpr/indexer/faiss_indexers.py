@@ -14,11 +14,62 @@ import logging
 import numpy as np
 import os
 import pickle
+import threading
+import time
 
 from typing import List, Tuple
 
+from dpr.indexer.id_mapping import IdMapping, is_id_mapping_file
+
 logger = logging.getLogger()
 
+# number of vectors stacked at once when only their norms are needed
+NORMS_BLOCK_SIZE = 100000
+
+
+def stack_vectors(data: List[Tuple[object, np.array]]) -> np.array:
+    """
+    Stacks the vectors of (id, vector, ...) items into one contiguous float32 matrix
+    """
+    return np.ascontiguousarray(np.stack([t[1] for t in data]), dtype=np.float32)
+
+
+def squared_norms(vectors: np.array) -> np.array:
+    return np.einsum("ij,ij->i", vectors, vectors)
+
+
+def is_mmapped(index) -> bool:
+    """
+    Whether the data of an index read with IO_FLAG_MMAP is memory-mapped. faiss only maps the inverted lists of IVF
+    indexes (e.g. DenseIVFPQIndexer); flat and HNSW indexes are read into RAM whatever the flag
+    """
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return False
+    return isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+
+
+def read_index(index_file: str, mmap: bool = False):
+    """
+    Reads a faiss index, memory-mapping it when mmap is set and the index type supports it (IVF indexes, see
+    is_mmapped); the pages are then loaded on demand and shared by all processes reading the same file
+    """
+    if mmap:
+        try:
+            index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.info("Index %s cannot be memory-mapped, reading it into RAM: %s", index_file, e)
+        else:
+            if not is_mmapped(index):
+                logger.warning(
+                    "Index %s of type %s was read into RAM: faiss only memory-maps IVF indexes",
+                    index_file,
+                    type(index).__name__,
+                )
+            return index
+    return faiss.read_index(index_file)
+
 
 class DenseIndexer(object):
     def __init__(self, buffer_size: int = 50000):
@@ -49,8 +100,7 @@ class DenseIndexer(object):
             meta_file = file + ".index_meta.dpr"
 
         faiss.write_index(self.index, index_file)
-        with open(meta_file, mode="wb") as f:
-            pickle.dump(self.index_id_to_db_id, f)
+        self.get_id_mapping().save(meta_file)
 
     def get_files(self, path: str):
         if os.path.isdir(path):
@@ -65,20 +115,37 @@ class DenseIndexer(object):
         index_file, meta_file = self.get_files(path)
         return os.path.isfile(index_file) and os.path.isfile(meta_file)
 
-    def deserialize(self, path: str):
+    def deserialize(self, path: str, mmap: bool = False):
+        """
+        :param mmap: memory-map the id mapping, and the index where faiss supports it (IVF indexes), instead of
+        reading them into RAM; the index is then read-only
+        """
         logger.info("Loading index from %s", path)
         index_file, meta_file = self.get_files(path)
 
-        self.index = faiss.read_index(index_file)
+        self.index = read_index(index_file, mmap=mmap)
         logger.info("Loaded index of type %s and size %d", type(self.index), self.index.ntotal)
 
-        with open(meta_file, "rb") as reader:
-            self.index_id_to_db_id = pickle.load(reader)
+        if is_id_mapping_file(meta_file):
+            self.index_id_to_db_id = IdMapping.load(meta_file, mmap=mmap)
+        else:
+            # index meta files written before the id mapping format are pickled lists
+            with open(meta_file, "rb") as reader:
+                self.index_id_to_db_id = pickle.load(reader)
         assert (
             len(self.index_id_to_db_id) == self.index.ntotal
         ), "Deserialized index_id_to_db_id should match faiss index size"
 
+    def get_id_mapping(self) -> IdMapping:
+        # the ids collected while indexing are compacted on first use
+        if not isinstance(self.index_id_to_db_id, IdMapping):
+            self.index_id_to_db_id = IdMapping.from_list(self.index_id_to_db_id)
+        return self.index_id_to_db_id
+
     def _update_id_mapping(self, db_ids: List) -> int:
+        if not isinstance(self.index_id_to_db_id, list):
+            # a loaded IdMapping is read-only
+            self.index_id_to_db_id = list(self.index_id_to_db_id)
         self.index_id_to_db_id.extend(db_ids)
         return len(self.index_id_to_db_id)
 
@@ -95,8 +162,7 @@ class DenseFlatIndexer(DenseIndexer):
         # indexing in batches is beneficial for many faiss index types
         for i in range(0, n, self.buffer_size):
             db_ids = [t[0] for t in data[i : i + self.buffer_size]]
-            vectors = [np.reshape(t[1], (1, -1)) for t in data[i : i + self.buffer_size]]
-            vectors = np.concatenate(vectors, axis=0)
+            vectors = stack_vectors(data[i : i + self.buffer_size])
             total_data = self._update_id_mapping(db_ids)
             self.index.add(vectors)
             logger.info("data indexed %d", total_data)
@@ -107,7 +173,7 @@ class DenseFlatIndexer(DenseIndexer):
     def search_knn(self, query_vectors: np.array, top_docs: int) -> List[Tuple[List[object], List[float]]]:
         scores, indexes = self.index.search(query_vectors, top_docs)
         # convert to external ids
-        db_ids = [[self.index_id_to_db_id[i] for i in query_top_idxs] for query_top_idxs in indexes]
+        db_ids = self.get_id_mapping().translate(indexes)
         result = [(db_ids[i], scores[i]) for i in range(len(db_ids))]
         return result
 
@@ -122,7 +188,7 @@ class DenseHNSWFlatIndexer(DenseIndexer):
 
     def __init__(
         self,
-        buffer_size: int = 1e9,
+        buffer_size: int = 50000,
         store_n: int = 512,
         ef_search: int = 128,
         ef_construction: int = 200,
@@ -132,6 +198,7 @@ class DenseHNSWFlatIndexer(DenseIndexer):
         self.ef_search = ef_search
         self.ef_construction = ef_construction
         self.phi = 0
+        self.streaming = False
 
     def init_index(self, vector_sz: int):
         # IndexHNSWFlat supports L2 similarity only
@@ -144,29 +211,37 @@ class DenseHNSWFlatIndexer(DenseIndexer):
     def index_data(self, data: List[Tuple[object, np.array]]):
         n = len(data)
 
-        # max norm is required before putting all vectors in the index to convert inner product similarity to L2
-        if self.phi > 0:
+        # max norm is required before putting all vectors in the index to convert inner product similarity to L2.
+        # It is either set upfront with set_phi (streaming build) or computed from this data
+        if self.phi > 0 and not self.streaming:
             raise RuntimeError(
-                "DPR HNSWF index needs to index all data at once," "results will be unpredictable otherwise."
+                "DPR HNSWF index needs to index all data at once or have phi set upfront with set_phi(), "
+                "results will be unpredictable otherwise."
             )
-        phi = 0
-        for i, item in enumerate(data):
-            id, doc_vector = item[0:2]
-            norms = (doc_vector ** 2).sum()
-            phi = max(phi, norms)
-        logger.info("HNSWF DotProduct -> L2 space phi={}".format(phi))
-        self.phi = phi
+        bs = int(self.buffer_size)
+        if self.streaming:
+            norms = None
+        else:
+            # one vectorized pass over blocks of the data for the norms, reused when the vectors are added
+            block = min(bs, NORMS_BLOCK_SIZE)
+            norms = np.zeros(n, dtype=np.float32)
+            for i in range(0, n, block):
+                norms[i : i + block] = squared_norms(stack_vectors(data[i : i + block]))
+            self.phi = float(norms.max()) if n else 0
+            logger.info("HNSWF DotProduct -> L2 space phi={}".format(self.phi))
 
         # indexing in batches is beneficial for many faiss index types
-        bs = int(self.buffer_size)
         for i in range(0, n, bs):
             db_ids = [t[0] for t in data[i : i + bs]]
-            vectors = [np.reshape(t[1], (1, -1)) for t in data[i : i + bs]]
-
-            norms = [(doc_vector ** 2).sum() for doc_vector in vectors]
-            aux_dims = [np.sqrt(phi - norm) for norm in norms]
-            hnsw_vectors = [np.hstack((doc_vector, aux_dims[i].reshape(-1, 1))) for i, doc_vector in enumerate(vectors)]
-            hnsw_vectors = np.concatenate(hnsw_vectors, axis=0)
+            vectors = stack_vectors(data[i : i + bs])
+            batch_norms = squared_norms(vectors) if norms is None else norms[i : i + bs]
+            if self.streaming and batch_norms.max() > self.phi:
+                logger.warning(
+                    "Vector norm %f exceeds phi=%f, inner product order is not preserved for it",
+                    batch_norms.max(),
+                    self.phi,
+                )
+            hnsw_vectors = self.to_hnsw_vectors(vectors, self.phi, batch_norms)
             self.train(hnsw_vectors)
 
             self._update_id_mapping(db_ids)
@@ -175,6 +250,25 @@ class DenseHNSWFlatIndexer(DenseIndexer):
         indexed_cnt = len(self.index_id_to_db_id)
         logger.info("Total data indexed %d", indexed_cnt)
 
+    def set_phi(self, phi: float):
+        """
+        Sets the max squared norm of all the vectors to be indexed (see dense_retriever.compute_max_norm),
+        so that index_data can be called with consecutive bounded batches instead of the whole data at once
+        """
+        logger.info("HNSWF DotProduct -> L2 space phi={} (streaming build)".format(phi))
+        self.phi = phi
+        self.streaming = True
+
+    @staticmethod
+    def to_hnsw_vectors(vectors: np.array, phi: float, norms: np.array = None) -> np.array:
+        """
+        Appends the aux dimension sqrt(phi - |v|^2) that turns inner product search into L2 search
+        """
+        if norms is None:
+            norms = squared_norms(vectors)
+        aux_dims = np.sqrt(np.maximum(phi - norms, 0)).astype(np.float32)
+        return np.hstack((vectors, aux_dims.reshape(-1, 1)))
+
     def train(self, vectors: np.array):
         pass
 
@@ -185,12 +279,12 @@ class DenseHNSWFlatIndexer(DenseIndexer):
         logger.info("query_hnsw_vectors %s", query_nhsw_vectors.shape)
         scores, indexes = self.index.search(query_nhsw_vectors, top_docs)
         # convert to external ids
-        db_ids = [[self.index_id_to_db_id[i] for i in query_top_idxs] for query_top_idxs in indexes]
+        db_ids = self.get_id_mapping().translate(indexes)
         result = [(db_ids[i], scores[i]) for i in range(len(db_ids))]
         return result
 
-    def deserialize(self, file: str):
-        super(DenseHNSWFlatIndexer, self).deserialize(file)
+    def deserialize(self, file: str, mmap: bool = False):
+        super(DenseHNSWFlatIndexer, self).deserialize(file, mmap=mmap)
         # to trigger exception on subsequent indexing
         self.phi = 1
 
@@ -226,7 +320,124 @@ class DenseHNSWSQIndexer(DenseHNSWFlatIndexer):
         self.index = index
 
     def train(self, vectors: np.array):
-        self.index.train(vectors)
+        # in a streaming build the scalar quantizer ranges are trained on the first batch only,
+        # codes of the following batches must use the same ranges
+        if not self.index.is_trained:
+            self.index.train(vectors)
 
     def get_index_name(self):
         return "hnswsq_index"
+
+
+class DenseIVFPQIndexer(DenseIndexer):
+    """
+    Compressed inner product index: an inverted file of nlist clusters over product quantized vectors
+    (m sub-vectors of nbits each, i.e. m * nbits / 8 bytes per passage instead of 4 * vector size).
+    The quantizers are trained on a random sample of at most train_size vectors of the first indexed buffer,
+    so buffer_size should be large enough to give a representative sample.
+    nprobe (the number of clusters visited by a search) trades recall for speed and can be set per search_knn call.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = 1000000,
+        nlist: int = 16384,
+        m: int = 64,
+        nbits: int = 8,
+        nprobe: int = 128,
+        train_size: int = 1000000,
+        seed: int = 0,
+    ):
+        super(DenseIVFPQIndexer, self).__init__(buffer_size=buffer_size)
+        self.nlist = nlist
+        self.m = m
+        self.nbits = nbits
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.seed = seed
+        self._nprobe_lock = threading.Lock()
+
+    def get_factory_string(self) -> str:
+        return "IVF{},PQ{}x{}".format(self.nlist, self.m, self.nbits)
+
+    def init_index(self, vector_sz: int):
+        if vector_sz % self.m:
+            raise ValueError(
+                "Vector size {} is not divisible by the number of PQ sub-vectors {}".format(vector_sz, self.m)
+            )
+        self.index = faiss.index_factory(vector_sz, self.get_factory_string(), faiss.METRIC_INNER_PRODUCT)
+        faiss.extract_index_ivf(self.index).nprobe = self.nprobe
+
+    def index_data(self, data: List[Tuple[object, np.array]]):
+        n = len(data)
+        if n and not self.index.is_trained:
+            self.train(stack_vectors(data))
+
+        for i in range(0, n, self.buffer_size):
+            db_ids = [t[0] for t in data[i : i + self.buffer_size]]
+            vectors = stack_vectors(data[i : i + self.buffer_size])
+            total_data = self._update_id_mapping(db_ids)
+            self.index.add(vectors)
+            logger.info("data indexed %d", total_data)
+
+        indexed_cnt = len(self.index_id_to_db_id)
+        logger.info("Total data indexed %d", indexed_cnt)
+
+    def train(self, vectors: np.array):
+        if len(vectors) > self.train_size:
+            sample = np.random.RandomState(self.seed).choice(len(vectors), self.train_size, replace=False)
+            vectors = vectors[np.sort(sample)]
+        if len(vectors) < self.nlist:
+            raise RuntimeError(
+                "IVF-PQ index needs at least nlist={} training vectors, got {}".format(self.nlist, len(vectors))
+            )
+        logger.info("Training %s index on %d vectors", self.get_factory_string(), len(vectors))
+        time0 = time.time()
+        self.index.train(np.ascontiguousarray(vectors))
+        logger.info("Index training time: %f sec.", time.time() - time0)
+
+    def search_knn(
+        self, query_vectors: np.array, top_docs: int, nprobe: int = None
+    ) -> List[Tuple[List[object], List[float]]]:
+        scores, indexes = self._search(np.ascontiguousarray(query_vectors, dtype=np.float32), top_docs, nprobe)
+        # convert to external ids; -1 marks empty result slots when the visited clusters hold fewer than top_docs
+        db_ids = [[db_id for db_id in row if db_id is not None] for row in self.get_id_mapping().translate(indexes)]
+        result = [(db_ids[i], scores[i][: len(db_ids[i])]) for i in range(len(db_ids))]
+        return result
+
+    def _search(self, query_vectors: np.array, top_docs: int, nprobe: int = None):
+        if not nprobe or nprobe == self.nprobe:
+            return self.index.search(query_vectors, top_docs)
+        if hasattr(faiss, "SearchParametersIVF"):
+            # faiss >= 1.7.3: per call search parameters, safe with concurrent searches
+            params = faiss.SearchParametersIVF(nprobe=nprobe)
+            if isinstance(self.index, faiss.IndexPreTransform):
+                params = faiss.SearchParametersPreTransform(index_params=params)
+            return self.index.search(query_vectors, top_docs, params=params)
+        ivf = faiss.extract_index_ivf(self.index)
+        with self._nprobe_lock:
+            ivf.nprobe = nprobe
+            try:
+                return self.index.search(query_vectors, top_docs)
+            finally:
+                ivf.nprobe = self.nprobe
+
+    def deserialize(self, path: str, mmap: bool = False):
+        super(DenseIVFPQIndexer, self).deserialize(path, mmap=mmap)
+        faiss.extract_index_ivf(self.index).nprobe = self.nprobe
+
+    def get_index_name(self):
+        return "ivfpq_index"
+
+
+class DenseOPQIVFPQIndexer(DenseIVFPQIndexer):
+    """
+    IVF-PQ index with an OPQ rotation learned before product quantization, which lowers the quantization error
+    (and improves recall) at the same code size for a somewhat longer training.
+    """
+
+    def get_factory_string(self) -> str:
+        return "OPQ{},IVF{},PQ{}x{}".format(self.m, self.nlist, self.m, self.nbits)
+
+    def get_index_name(self):
+        return "opqivfpq_index"
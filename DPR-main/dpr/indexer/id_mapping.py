@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# Copyright (c) Facebook, Inc. and its affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+ Compact storage of the faiss index id -> external (db) id mapping of dense indexers
+"""
+
+import logging
+import os
+import struct
+
+import numpy as np
+
+from typing import List
+
+logger = logging.getLogger()
+
+MAGIC = b"DPRIDMAP"
+VERSION = 2
+# magic, version, kind, number of ids, size of the string bytes
+HEADER = struct.Struct("<8sIIQQ")
+# integer ids
+INT_IDS = 0
+# any other ids, as front coded utf-8 strings (version 1 files: plain strings)
+STR_IDS = 1
+# strings made of a common prefix and a decimal number, e.g. "wiki:123"
+PREFIXED_INT_IDS = 2
+# strings are front coded in blocks: the first string of a block is stored whole, the others as the length of
+# the prefix they share with the previous string and the remaining suffix
+BLOCK_SIZE = 16
+MAX_SHARED_PREFIX = 255
+
+
+def _is_int(db_id: object) -> bool:
+    return isinstance(db_id, (int, np.integer)) and not isinstance(db_id, bool)
+
+
+def _is_decimal(suffix: str) -> bool:
+    # only numbers which print back to the same string, so that ids round-trip exactly
+    return 0 < len(suffix) <= 18 and suffix.isascii() and suffix.isdigit() and (suffix == "0" or suffix[0] != "0")
+
+
+def _shared_prefix_length(a: bytes, b: bytes) -> int:
+    n = min(len(a), len(b), MAX_SHARED_PREFIX)
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class IdMapping(object):
+    """
+    Read-only index id -> db id mapping. Integer ids are kept as an int64 array, ids like "wiki:123" as their common
+    prefix and an int64 array of numbers, any other string ids in a front coded string table. Other id types
+    (tuples, floats, a mix of integers and strings) cannot be represented and are refused by from_list().
+    Saved as a single versioned binary file which load() memory-maps, so the ids are neither unpickled nor copied
+    and processes loading the same file share its pages. translate() converts a whole search result matrix at once.
+    """
+
+    def __init__(
+        self,
+        ids: np.array = None,
+        prefix: str = "",
+        offsets: np.array = None,
+        blob: np.array = None,
+        shared_lengths: np.array = None,
+    ):
+        self.ids = ids
+        self.prefix = prefix
+        self.offsets = offsets
+        self.blob = blob
+        self.shared_lengths = shared_lengths
+
+    @property
+    def kind(self) -> int:
+        if self.ids is None:
+            return STR_IDS
+        return PREFIXED_INT_IDS if self.prefix else INT_IDS
+
+    @classmethod
+    def from_list(cls, db_ids: List[object]) -> "IdMapping":
+        if all(_is_int(db_id) for db_id in db_ids):
+            return cls(ids=np.asarray(db_ids, dtype=np.int64).reshape(-1))
+
+        unsupported = next((db_id for db_id in db_ids if not isinstance(db_id, str)), None)
+        if unsupported is not None:
+            # ids are stored as given and must come back unchanged, so mixed or other id types are refused
+            raise TypeError(
+                "Index ids must be all integers or all strings, got {!r} of type {}".format(
+                    unsupported, type(unsupported).__name__
+                )
+            )
+        prefix = os.path.commonprefix(db_ids).rstrip("0123456789")
+        if prefix and all(_is_decimal(db_id[len(prefix) :]) for db_id in db_ids):
+            return cls(ids=np.array([int(db_id[len(prefix) :]) for db_id in db_ids], dtype=np.int64), prefix=prefix)
+
+        suffixes = []
+        shared_lengths = np.zeros(len(db_ids), dtype=np.uint8)
+        previous = b""
+        for i, db_id in enumerate(db_ids):
+            encoded = db_id.encode("utf-8")
+            shared = _shared_prefix_length(previous, encoded) if i % BLOCK_SIZE else 0
+            shared_lengths[i] = shared
+            suffixes.append(encoded[shared:])
+            previous = encoded
+        offsets = np.zeros(len(suffixes) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in suffixes], out=offsets[1:])
+        blob = np.frombuffer(b"".join(suffixes), dtype=np.uint8)
+        return cls(offsets=offsets, blob=blob, shared_lengths=shared_lengths)
+
+    def __len__(self):
+        return len(self.ids) if self.ids is not None else len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> object:
+        if self.ids is not None:
+            return self.prefix + str(self.ids[i]) if self.prefix else int(self.ids[i])
+        if self.shared_lengths is None:
+            return bytes(self.blob[self.offsets[i] : self.offsets[i + 1]]).decode("utf-8")
+        value = b""
+        for j in range(i - i % BLOCK_SIZE, i + 1):
+            value = value[: self.shared_lengths[j]] + bytes(self.blob[self.offsets[j] : self.offsets[j + 1]])
+        return value.decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def translate(self, indexes: np.array) -> List[List[object]]:
+        """
+        Converts a (n_queries, k) matrix of faiss ids into lists of db ids; -1 (no result) becomes None
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        missing = indexes < 0
+        indexes = np.where(missing, 0, indexes)
+        if self.kind == INT_IDS:
+            db_ids = self.ids[indexes].astype(object)
+        elif self.kind == PREFIXED_INT_IDS:
+            db_ids = np.char.add(self.prefix, self.ids[indexes].astype(str)).astype(object)
+        else:
+            # strings are decoded once per distinct id of the result
+            unique, inverse = np.unique(indexes, return_inverse=True)
+            decoded = np.empty(len(unique), dtype=object)
+            decoded[:] = [self[i] for i in unique]
+            db_ids = decoded[inverse].reshape(indexes.shape)
+        if missing.any():
+            db_ids[missing] = None
+        return db_ids.tolist()
+
+    def save(self, file: str):
+        with open(file, mode="wb") as f:
+            kind = self.kind
+            if kind == STR_IDS:
+                f.write(HEADER.pack(MAGIC, VERSION, kind, len(self), len(self.blob)))
+                f.write(self.offsets.astype("<i8", copy=False).tobytes())
+                f.write(self.blob.tobytes())
+                shared_lengths = self.shared_lengths
+                if shared_lengths is None:
+                    shared_lengths = np.zeros(len(self), dtype=np.uint8)
+                f.write(shared_lengths.tobytes())
+                return
+            prefix = self.prefix.encode("utf-8")
+            f.write(HEADER.pack(MAGIC, VERSION, kind, len(self), len(prefix)))
+            # the prefix is padded so that the ids stay 8 bytes aligned
+            f.write(prefix + b"\0" * (-len(prefix) % 8))
+            f.write(self.ids.astype("<i8", copy=False).tobytes())
+
+    @classmethod
+    def load(cls, file: str, mmap: bool = True) -> "IdMapping":
+        if mmap:
+            data = np.memmap(file, dtype=np.uint8, mode="r")
+        else:
+            data = np.fromfile(file, dtype=np.uint8)
+        magic, version, kind, count, blob_size = HEADER.unpack(bytes(data[: HEADER.size]))
+        if magic != MAGIC:
+            raise ValueError("{} is not an id mapping file".format(file))
+        if version > VERSION:
+            raise ValueError("Unsupported id mapping version {} in {}".format(version, file))
+        start = HEADER.size
+        if kind == INT_IDS:
+            return cls(ids=data[start : start + 8 * count].view("<i8"))
+        if kind == PREFIXED_INT_IDS:
+            prefix = bytes(data[start : start + blob_size]).decode("utf-8")
+            start += blob_size + (-blob_size % 8)
+            return cls(ids=data[start : start + 8 * count].view("<i8"), prefix=prefix)
+        if kind != STR_IDS:
+            raise ValueError("Unknown id mapping kind {} in {}".format(kind, file))
+        offsets = data[start : start + 8 * (count + 1)].view("<i8")
+        start += 8 * (count + 1)
+        blob = data[start : start + blob_size]
+        shared_lengths = data[start + blob_size : start + blob_size + count] if version > 1 else None
+        return cls(offsets=offsets, blob=blob, shared_lengths=shared_lengths)
+
+
+def is_id_mapping_file(file: str) -> bool:
+    with open(file, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,132 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+
+# Function to normalize a question for exact-match lookups: case, punctuation
+# and whitespace differences do not change the answer
+def normalize_question(question):
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+# In-memory cache of generated answers. A question is first looked up by its
+# normalized text; failing that, by cosine similarity of its question encoder
+# embedding against the cached questions (a small flat FAISS index) above
+# similarity_threshold. Entries expire after ttl_seconds and the least recently
+# used ones are dropped beyond max_entries. Answers are only reused for the
+# same generation settings.
+class AnswerCache:
+    def __init__(self, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._keys_by_id = {}
+        self._next_id = 0
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get_exact(self, question, settings=()):
+        # exact-match only and no miss counted, so a later get() with the
+        # embedding can still find a near-duplicate
+        with self._lock:
+            entry = self._live_entry((settings, normalize_question(question)))
+            if entry is None:
+                return None
+            self.exact_hits += 1
+            return entry["answer"]
+
+    def get(self, question, settings=(), embedding=None):
+        with self._lock:
+            key = (settings, normalize_question(question))
+            entry = self._live_entry(key)
+            if entry is not None:
+                self.exact_hits += 1
+                return entry["answer"]
+            if embedding is not None and self._index is not None and self._index.ntotal:
+                entry = self._similar_entry(settings, embedding)
+                if entry is not None:
+                    self.similar_hits += 1
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def put(self, question, answer, settings=(), embedding=None):
+        with self._lock:
+            key = (settings, normalize_question(question))
+            self._remove(key)
+            entry_id = None
+            if embedding is not None:
+                vector = _unit_vector(embedding)
+                if self._index is None:
+                    self._index = faiss.IndexIDMap(faiss.IndexFlatIP(vector.shape[1]))
+                entry_id = self._next_id
+                self._next_id += 1
+                self._index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+                self._keys_by_id[entry_id] = key
+            self._entries[key] = {"answer": answer, "created": time.time(), "id": entry_id}
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "exact_hits": self.exact_hits,
+                    "similar_hits": self.similar_hits, "misses": self.misses}
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["created"] > self.ttl_seconds:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _similar_entry(self, settings, embedding):
+        k = min(8, self._index.ntotal)
+        scores, ids = self._index.search(_unit_vector(embedding), k)
+        for score, entry_id in zip(scores[0], ids[0]):
+            if score < self.similarity_threshold:
+                break
+            key = self._keys_by_id.get(int(entry_id))
+            if key is not None and key[0] == settings:
+                entry = self._live_entry(key)
+                if entry is not None:
+                    return entry
+        return None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry["id"] is not None:
+            self._index.remove_ids(np.array([entry["id"]], dtype="int64"))
+            del self._keys_by_id[entry["id"]]
+
+
+def _unit_vector(embedding):
+    vector = np.asarray(embedding, dtype="float32").reshape(1, -1)
+    return vector / max(np.linalg.norm(vector), 1e-12)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(
+                max_entries=int(os.environ.get("QA_CACHE_ENTRIES", "1000")),
+                ttl_seconds=float(os.environ.get("QA_CACHE_TTL", "3600")),
+                similarity_threshold=float(os.environ.get("QA_CACHE_SIMILARITY", "0.95")),
+            )
+        return _cache
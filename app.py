@@ -1,12 +1,22 @@
+import time
+
+START = time.perf_counter()
+
 import streamlit as st
 from multiapp import MultiApp
-from pages import summarization, qna
 
 app = MultiApp()
 
-# Add all your application here
-app.add_app("Summarization", summarization.app)
-app.add_app("Q&A with RAG", qna.app)
+# Add all your application here. Pages are imported on first selection.
+app.add_app("Summarization", "pages.summarization:summarization_page")
+app.add_app("Q&A with RAG", "pages.qna:qna_page")
+
+app.timings["startup"] = time.perf_counter() - START
 
 # The main app
 app.run()
+
+# Startup timing report for this run (module imports are only paid once per process)
+with st.sidebar.expander("Timings"):
+    for name, seconds in app.timings.items():
+        st.caption(f"{name}: {seconds * 1000:.0f} ms")
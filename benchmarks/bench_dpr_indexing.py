@@ -0,0 +1,97 @@
+"""
+Measures the ingestion throughput of the DPR flat and HNSW indexers.
+
+    python benchmarks/bench_dpr_indexing.py [--vectors 1000000] [--dim 768]
+                                            [--buffer-size 50000] [--add]
+
+Random (id, vector) items in the format of the encoded passage files are
+turned into index batches the way index_data used to (per vector reshape,
+norms and hstack in Python, then np.concatenate) and with the vectorized
+helpers of dpr.indexer.faiss_indexers. With --add the batches are also added
+to a faiss index, which shows their share of the whole build time.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DPR-main"))
+
+import faiss  # noqa: E402
+
+from dpr.indexer.faiss_indexers import DenseHNSWFlatIndexer, squared_norms, stack_vectors  # noqa: E402
+
+
+def make_data(n, dim, seed=0):
+    rng = np.random.RandomState(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    return [("wiki:{}".format(i), vectors[i]) for i in range(n)]
+
+
+def legacy_flat_batches(data, buffer_size):
+    for i in range(0, len(data), buffer_size):
+        vectors = [np.reshape(t[1], (1, -1)) for t in data[i : i + buffer_size]]
+        yield np.concatenate(vectors, axis=0)
+
+
+def legacy_hnsw_batches(data, buffer_size):
+    phi = 0
+    for item in data:
+        phi = max(phi, (item[1] ** 2).sum())
+    for i in range(0, len(data), buffer_size):
+        vectors = [np.reshape(t[1], (1, -1)) for t in data[i : i + buffer_size]]
+        norms = [(doc_vector ** 2).sum() for doc_vector in vectors]
+        aux_dims = [np.sqrt(phi - norm) for norm in norms]
+        hnsw_vectors = [np.hstack((doc_vector, aux_dims[j].reshape(-1, 1))) for j, doc_vector in enumerate(vectors)]
+        yield np.concatenate(hnsw_vectors, axis=0)
+
+
+def flat_batches(data, buffer_size):
+    for i in range(0, len(data), buffer_size):
+        yield stack_vectors(data[i : i + buffer_size])
+
+
+def hnsw_batches(data, buffer_size):
+    norms = np.zeros(len(data), dtype=np.float32)
+    for i in range(0, len(data), buffer_size):
+        norms[i : i + buffer_size] = squared_norms(stack_vectors(data[i : i + buffer_size]))
+    phi = float(norms.max())
+    for i in range(0, len(data), buffer_size):
+        vectors = stack_vectors(data[i : i + buffer_size])
+        yield DenseHNSWFlatIndexer.to_hnsw_vectors(vectors, phi, norms[i : i + buffer_size])
+
+
+def run(batches, index=None):
+    start = time.perf_counter()
+    n = 0
+    for batch in batches:
+        if index is not None:
+            index.add(batch)
+        n += len(batch)
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--buffer-size", type=int, default=50000)
+    parser.add_argument("--add", action="store_true", help="also add the batches to a flat faiss index")
+    args = parser.parse_args()
+
+    data = make_data(args.vectors, args.dim)
+    print("{} vectors of dimension {}, batches of {}".format(args.vectors, args.dim, args.buffer_size))
+    for name, legacy, vectorized, dim in [
+        ("flat", legacy_flat_batches, flat_batches, args.dim),
+        ("hnsw", legacy_hnsw_batches, hnsw_batches, args.dim + 1),
+    ]:
+        before = run(legacy(data, args.buffer_size), faiss.IndexFlatIP(dim) if args.add else None)
+        after = run(vectorized(data, args.buffer_size), faiss.IndexFlatIP(dim) if args.add else None)
+        print("{:5} before {:12,.0f} vectors/s  after {:12,.0f} vectors/s  ({:.1f}x)".format(
+            name, before, after, after / before))
+
+
+if __name__ == "__main__":
+    main()
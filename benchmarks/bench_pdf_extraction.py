@@ -0,0 +1,60 @@
+"""
+Compares serial and process-pool PDF text extraction.
+
+    python benchmarks/bench_pdf_extraction.py [--pdf report.pdf] [--workers 2 4 8]
+
+Without --pdf a synthetic text-heavy PDF is generated first.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_extraction import iter_pdf_text, iter_pdf_text_parallel  # noqa: E402
+
+
+def make_pdf(path, pages):
+    line = "The quick brown fox jumps over the lazy dog while the report keeps going. "
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), f"Page {i + 1}. " + line * 40, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    text = "".join(fn())
+    return time.perf_counter() - start, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf", help="PDF to extract (a synthetic one is generated if omitted)")
+    parser.add_argument("--pages", type=int, default=2000, help="pages of the synthetic PDF")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, os.cpu_count() or 4])
+    parser.add_argument("--pages-per-batch", type=int, default=16)
+    args = parser.parse_args()
+
+    path = args.pdf
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), "bench.pdf")
+        make_pdf(path, args.pages)
+
+    serial, n_chars = timed(lambda: iter_pdf_text(path, pages_per_batch=args.pages_per_batch))
+    print(f"serial      {serial:8.2f}s  {n_chars} chars")
+    for workers in sorted(set(args.workers)):
+        elapsed, parallel_chars = timed(
+            lambda: iter_pdf_text_parallel(path, workers=workers, pages_per_batch=args.pages_per_batch))
+        assert parallel_chars == n_chars, "parallel extraction returned different text"
+        print(f"workers={workers:<3} {elapsed:8.2f}s  speedup x{serial / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
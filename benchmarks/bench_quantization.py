@@ -0,0 +1,123 @@
+"""
+Compares the fp32 summarizer with the dynamically quantized int8 CPU backend.
+
+    python benchmarks/bench_quantization.py [--model t5-small] [--corpus docs/*.txt]
+                                            [--threads 4] [--batch-size 8]
+
+Reports per-chunk latency, throughput and ROUGE-1/ROUGE-L F1 of the int8
+summaries against the fp32 summaries of the same fixed corpus (the drift).
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunking import chunk_by_tokens, token_budget  # noqa: E402
+from model_registry import configure_threads, load_pipeline  # noqa: E402
+
+# Used when no --corpus is given, so runs on different machines are comparable
+DEFAULT_CORPUS = [
+    "The city council approved the new budget on Tuesday after a lengthy debate. The plan increases "
+    "spending on public transport by twelve percent and funds two new libraries. Critics argued that "
+    "the council had not explained how the increase would be paid for, while supporters said the "
+    "investment was overdue. The mayor is expected to sign the budget next week.",
+    "Researchers have developed a battery that charges in under five minutes and keeps most of its "
+    "capacity after thousands of cycles. The team replaced the graphite anode with a niobium-based "
+    "material that lets lithium ions move more freely. Commercial production is still years away, "
+    "but several car makers have expressed interest in the technology.",
+    "The agreement requires the supplier to deliver the goods within thirty days of each purchase "
+    "order. Late deliveries incur a penalty of two percent of the order value per week, capped at "
+    "ten percent. Either party may terminate the agreement with ninety days written notice, and "
+    "disputes are to be resolved by arbitration in the buyer's jurisdiction.",
+    "Heavy rain caused flooding across the region over the weekend, closing roads and forcing "
+    "hundreds of residents to leave their homes. Emergency services rescued several people trapped "
+    "in cars. Forecasters expect the weather to improve by Wednesday, although rivers may continue "
+    "to rise for several days as water drains from the hills.",
+]
+
+GENERATION_KWARGS = {"max_length": 150, "min_length": 30, "do_sample": False}
+
+
+def load_corpus(patterns):
+    if not patterns:
+        return DEFAULT_CORPUS
+    texts = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, encoding="utf-8") as f:
+                texts.append(f.read())
+    return texts
+
+
+def lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def f1(overlap, n_candidate, n_reference):
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / n_candidate, overlap / n_reference
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge(candidate, reference):
+    cand, ref = candidate.lower().split(), reference.lower().split()
+    unigram_overlap = sum(min(cand.count(w), ref.count(w)) for w in set(cand))
+    return f1(unigram_overlap, len(cand), len(ref)), f1(lcs_length(cand, ref), len(cand), len(ref))
+
+
+def run(pipe, chunks, batch_size):
+    latencies, summaries = [], []
+    start = time.perf_counter()
+    for i in range(0, len(chunks), batch_size):
+        batch = chunks[i:i + batch_size]
+        batch_start = time.perf_counter()
+        outputs = pipe(batch, batch_size=len(batch), truncation=True, **GENERATION_KWARGS)
+        latencies.append((time.perf_counter() - batch_start) / len(batch))
+        summaries.extend(o["summary_text"] for o in outputs)
+    return summaries, latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="t5-small")
+    parser.add_argument("--corpus", nargs="*", help="glob patterns of .txt files")
+    parser.add_argument("--threads", type=int, help="intra-op threads")
+    parser.add_argument("--interop-threads", type=int)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    configure_threads(args.threads, args.interop_threads)
+    results = {}
+    for dtype in ("float32", "qint8"):
+        pipe = load_pipeline("summarization", args.model, dtype)
+        chunks = [c for text in load_corpus(args.corpus) for c in chunk_by_tokens(text, pipe.tokenizer,
+                                                                                   token_budget(pipe))]
+        # warm-up so lazy initialisation is not timed
+        pipe(chunks[:1], **GENERATION_KWARGS)
+        results[dtype] = run(pipe, chunks, args.batch_size)
+
+    print(f"{'backend':<8} {'p50 ms/chunk':>13} {'p95 ms/chunk':>13} {'chunks/s':>9}")
+    for dtype, (summaries, latencies, total) in results.items():
+        latencies = sorted(latencies)
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        print(f"{dtype:<8} {statistics.median(latencies) * 1000:13.1f} {p95 * 1000:13.1f} "
+              f"{len(summaries) / total:9.2f}")
+
+    scores = [rouge(q, f) for q, f in zip(results["qint8"][0], results["float32"][0])]
+    print(f"ROUGE drift of qint8 vs float32: ROUGE-1 F1 {statistics.mean(s[0] for s in scores):.3f}, "
+          f"ROUGE-L F1 {statistics.mean(s[1] for s in scores):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Smoke test of the prepared RAG index path: writes a tiny passages dataset and
+FAISS index with prepare_rag_index.write_prepared_index, loads it back with
+rag_loader.load_prepared_index and checks searches and passage lookups.
+
+    python benchmarks/smoke_prepared_index.py [--passages 64] [--dim 768]
+
+Needs faiss, datasets and transformers but no model download.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import faiss
+import numpy as np
+from datasets import Dataset
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prepare_rag_index import write_prepared_index  # noqa: E402
+from rag_loader import has_prepared_index, load_prepared_index  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--passages", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    embeddings = rng.standard_normal((args.passages, args.dim)).astype("float32")
+    dataset = Dataset.from_dict({
+        "title": [f"Title {i}" for i in range(args.passages)],
+        "text": [f"Passage number {i}." for i in range(args.passages)],
+        "embeddings": embeddings.tolist(),
+    })
+    index = faiss.IndexFlatIP(args.dim)
+    index.add(embeddings)
+
+    with tempfile.TemporaryDirectory() as out:
+        write_prepared_index(dataset, index, out)
+        assert has_prepared_index(out)
+        # load_prepared_index only reads retrieval_vector_size from the RAG config
+        rag_index = load_prepared_index(SimpleNamespace(retrieval_vector_size=args.dim), out)
+        assert rag_index.is_initialized()
+
+        ids, vectors = rag_index.get_top_docs(embeddings[:3], n_docs=5)
+        assert ids.shape == (3, 5) and vectors.shape == (3, 5, args.dim)
+        assert list(ids[:, 0]) == [0, 1, 2], ids[:, 0]
+        docs = rag_index.get_doc_dicts(ids)
+        assert docs[0]["title"][0] == "Title 0", docs[0]
+    print(f"Prepared index OK: {args.passages} passages of dimension {args.dim}")
+
+
+if __name__ == "__main__":
+    main()
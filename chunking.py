@@ -0,0 +1,251 @@
+import re
+import unicodedata
+import zlib
+from collections import namedtuple
+from itertools import chain, islice
+
+from tracing import span, traced_iter
+
+# Sentence ends: ., ! or ? (optionally followed by up to two closing quotes or
+# brackets, which stay with the sentence) and whitespace, or a blank line
+# between paragraphs
+_SENTENCE_END = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\')\]])|(?<=[.!?]["\')\]]{2}))\s+|\n\s*\n')
+
+# Fallback when the tokenizer reports no usable limit (some report 1e30)
+DEFAULT_MAX_TOKENS = 512
+
+# With content-defined chunking, on average one sentence in this many ends a chunk
+DEFAULT_BOUNDARY_EVERY = 8
+
+# An unfinished sentence is carried over to the next piece only while it is
+# shorter than this many characters per token of the chunk budget
+TAIL_CHARS_PER_TOKEN = 8
+
+
+# Function to split text into sentences, keeping every non-empty piece
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+
+# Function to normalize text before hashing, so that re-extracted or re-flowed
+# copies of the same passage (different line breaks, ligatures) hash the same
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+# Function to work out how many input tokens one chunk may use
+def token_budget(summarizer, max_tokens=None):
+    tokenizer = summarizer.tokenizer
+    limit = max_tokens or getattr(tokenizer, "model_max_length", DEFAULT_MAX_TOKENS)
+    if not limit or limit > 100000:
+        limit = DEFAULT_MAX_TOKENS
+    # T5 pipelines prepend a task prefix ("summarize: ") and an EOS token
+    prefix = getattr(summarizer, "prefix", None) or ""
+    if not prefix:
+        params = getattr(summarizer.model.config, "task_specific_params", None) or {}
+        prefix = params.get("summarization", {}).get("prefix", "")
+    reserved = tokenizer.num_special_tokens_to_add()
+    if prefix:
+        reserved += len(tokenizer(prefix, add_special_tokens=False)["input_ids"])
+    return max(limit - reserved, 1)
+
+
+# Function to pack sentences into chunks of at most max_tokens tokens, using the
+# tokenizer's real counts. Sentences longer than the budget are split on tokens.
+def chunk_by_tokens(text, tokenizer, max_tokens):
+    return list(_iter_packed([split_sentences(text)], tokenizer, max_tokens))
+
+
+# Function to chunk a stream of text pieces (e.g. PDF pages) as they arrive.
+# A sentence running over a page break is completed with the next piece before
+# it is packed, and each chunk is yielded as soon as it is full.
+#
+# With content_defined=True chunks also end after any sentence whose normalized
+# hash hits 1 in boundary_every (once the chunk holds a quarter of the budget).
+# Boundaries then depend on the sentences themselves rather than on offsets, so
+# an edit early in a document only changes the chunks around the edit and the
+# later chunks (and their cached summaries) stay the same.
+def iter_chunks(pieces, tokenizer, max_tokens, content_defined=False, boundary_every=DEFAULT_BOUNDARY_EVERY):
+    return _iter_packed(_iter_sentences(pieces, max_tokens * TAIL_CHARS_PER_TOKEN), tokenizer, max_tokens,
+                        boundary_every=boundary_every if content_defined else None)
+
+
+# Function to greedily join consecutive texts into chunks that fit max_tokens and,
+# optionally, contain at most max_items texts each
+def pack_texts(texts, tokenizer, max_tokens, max_items=None):
+    return list(_iter_packed([texts], tokenizer, max_tokens, max_items))
+
+
+def _iter_sentences(pieces, max_tail_chars=None):
+    tail = ""
+    for piece in pieces:
+        sentences = split_sentences(tail + " " + piece if tail else piece)
+        # the last sentence may continue in the next piece
+        tail = sentences.pop() if sentences else ""
+        # text without sentence ends (tables, OCR output) would grow the tail
+        # to the whole document; past the limit it is packed as it is
+        if max_tail_chars and len(tail) > max_tail_chars:
+            sentences.append(tail)
+            tail = ""
+        if sentences:
+            yield sentences
+    if tail:
+        yield [tail]
+
+
+def _is_boundary(sentence, boundary_every):
+    return zlib.crc32(normalize_text(sentence).encode("utf-8")) % boundary_every == 0
+
+
+def _iter_packed(text_groups, tokenizer, max_tokens, max_items=None, boundary_every=None):
+    min_tokens = max_tokens // 4
+    current, current_len = [], 0
+    for texts in text_groups:
+        if not texts:
+            continue
+        counts = [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+        for text, n_tokens in zip(texts, counts):
+            if n_tokens > max_tokens:
+                if current:
+                    yield " ".join(current)
+                    current, current_len = [], 0
+                yield from _split_long_sentence(text, tokenizer, max_tokens)
+                continue
+            # +1 for the space joining two texts
+            full = max_items is not None and len(current) >= max_items
+            if current and (full or current_len + n_tokens + 1 > max_tokens):
+                yield " ".join(current)
+                current, current_len = [], 0
+            current.append(text)
+            current_len += n_tokens + (1 if current_len else 0)
+            if boundary_every and current_len >= min_tokens and _is_boundary(text, boundary_every):
+                yield " ".join(current)
+                current, current_len = [], 0
+    if current:
+        yield " ".join(current)
+
+
+def _split_long_sentence(sentence, tokenizer, max_tokens):
+    ids = tokenizer(sentence, add_special_tokens=False)["input_ids"]
+    pieces = [ids[i:i + max_tokens] for i in range(0, len(ids), max_tokens)]
+    return [tokenizer.decode(piece, skip_special_tokens=True).strip() for piece in pieces]
+
+
+# A chunk summary as soon as it is ready: level 0 summarizes document chunks,
+# higher levels summarize the summaries below them (map-reduce mode)
+PartialSummary = namedtuple("PartialSummary", ["level", "index", "text"])
+
+
+# Function to run all chunks through the pipeline in padded batches, yielding
+# (index, summary) pairs as each batch finishes. Chunks are sorted by length so
+# each batch pads to a similar size. A chunk iterator is consumed batch by
+# batch, so inference starts before the input has been fully read; its first
+# batch holds first_batch_size chunks to get the first summary out quickly.
+# With a chunk_store (see summary_cache.ChunkSummaryStore) only uncached chunks
+# are run and cached summaries are yielded first.
+def iter_chunk_summaries(summarizer, chunks, batch_size=8, chunk_store=None, first_batch_size=None,
+                         **generate_kwargs):
+    if not isinstance(chunks, list):
+        chunks = iter(chunks)
+        offset = 0
+        # pulling a batch of chunks also pulls the text pieces (e.g. PDF pages) it needs
+        with span("chunking"):
+            first = list(islice(chunks, first_batch_size or batch_size))
+        for batch in chain([first] if first else [], traced_iter(iter_batches(chunks, batch_size), "chunking")):
+            for i, summary in iter_chunk_summaries(summarizer, batch, batch_size, chunk_store, **generate_kwargs):
+                yield offset + i, summary
+            offset += len(batch)
+        return
+
+    cached = {}
+    if chunk_store is not None:
+        with span("chunk cache lookup", chunks=len(chunks)):
+            cached = chunk_store.lookup(chunks)
+    for i in sorted(cached):
+        yield i, cached[i]
+    missing = [i for i in range(len(chunks)) if i not in cached]
+
+    order = sorted(missing, key=lambda i: len(chunks[i]), reverse=True)
+    for start in range(0, len(order), batch_size):
+        batch_ids = order[start:start + batch_size]
+        batch = [chunks[i] for i in batch_ids]
+        with span("inference batch", chunks=len(batch)):
+            outputs = summarizer(batch, batch_size=len(batch), truncation=True, **generate_kwargs)
+        batch_summaries = [output["summary_text"] for output in outputs]
+        if chunk_store is not None:
+            chunk_store.store(batch, batch_summaries)
+        yield from sorted(zip(batch_ids, batch_summaries))
+
+
+# Function to summarize all chunks, returning the summaries in chunk order
+def summarize_chunks(summarizer, chunks, batch_size=8, chunk_store=None, **generate_kwargs):
+    summaries = dict(iter_chunk_summaries(summarizer, chunks, batch_size, chunk_store, **generate_kwargs))
+    return [summaries[i] for i in range(len(summaries))]
+
+
+# Function to group any iterable into lists of at most batch_size items
+def iter_batches(items, batch_size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+# Function to summarize very long documents level by level: summarize all chunks
+# of the text (a string or an iterable of pieces, e.g. PDF pages), then re-chunk
+# the concatenated summaries (at most fan_in per chunk) and summarize again
+# until the result fits target_tokens or max_depth is reached. Every level goes
+# through the same batched path, and each summary of every level is yielded as
+# a PartialSummary as soon as it is ready (see final_summary for the result).
+def iter_map_reduce(text, summarizer, target_tokens=512, fan_in=4, max_depth=3, batch_size=8,
+                    chunk_store=None, content_defined=False, first_batch_size=1, **generate_kwargs):
+    tokenizer = summarizer.tokenizer
+    budget = token_budget(summarizer)
+    chunks = iter_chunks([text] if isinstance(text, str) else text, tokenizer, budget,
+                         content_defined=content_defined)
+    summaries = {}
+    for i, summary in iter_chunk_summaries(summarizer, chunks, batch_size, chunk_store,
+                                           first_batch_size=first_batch_size, **generate_kwargs):
+        summaries[i] = summary
+        yield PartialSummary(0, i, summary)
+
+    for level in range(1, max_depth + 1):
+        summaries = [summaries[i] for i in range(len(summaries))]
+        if len(summaries) <= 1 or _count_tokens(tokenizer, " ".join(summaries)) <= target_tokens:
+            return
+        chunks = pack_texts(summaries, tokenizer, budget, max_items=fan_in)
+        summaries = {}
+        for i, summary in iter_chunk_summaries(summarizer, chunks, batch_size, chunk_store, **generate_kwargs):
+            summaries[i] = summary
+            yield PartialSummary(level, i, summary)
+
+
+# Function to summarize the chunks of a text in one level, yielding each
+# PartialSummary as soon as it is ready
+def iter_summaries(text, summarizer, batch_size=8, chunk_store=None, content_defined=False, first_batch_size=1,
+                   **generate_kwargs):
+    chunks = iter_chunks([text] if isinstance(text, str) else text, summarizer.tokenizer,
+                         token_budget(summarizer), content_defined=content_defined)
+    for i, summary in iter_chunk_summaries(summarizer, chunks, batch_size, chunk_store,
+                                           first_batch_size=first_batch_size, **generate_kwargs):
+        yield PartialSummary(0, i, summary)
+
+
+# Function to build the final summary from PartialSummary items: the summaries
+# of the highest level, in chunk order
+def final_summary(partials):
+    partials = list(partials)
+    if not partials:
+        return ""
+    top = max(p.level for p in partials)
+    return " ".join(p.text for p in sorted(p for p in partials if p.level == top))
+
+
+def summarize_map_reduce(text, summarizer, **kwargs):
+    return final_summary(iter_map_reduce(text, summarizer, **kwargs))
+
+
+def _count_tokens(tokenizer, text):
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
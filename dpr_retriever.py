@@ -0,0 +1,206 @@
+import os
+import sqlite3
+import threading
+
+import faiss
+import numpy as np
+from transformers import RagRetriever
+from transformers.models.rag.retrieval_rag import Index
+
+from dpr.data.biencoder_data import BiEncoderPassage
+from dpr.data.retriever_data import CsvCtxSrc
+from dpr.indexer.faiss_indexers import (
+    DenseFlatIndexer,
+    DenseHNSWFlatIndexer,
+    DenseHNSWSQIndexer,
+    DenseIVFPQIndexer,
+    DenseOPQIVFPQIndexer,
+)
+
+# Local DPR artifacts used instead of the wiki_dpr download when DPR_INDEX_PATH
+# is set: an index written by DenseIndexer.serialize (dense_retriever.py with
+# index_path=...) and the DPR passages TSV (id, text, title) it was built from
+DPR_INDEX_PATH = os.environ.get("DPR_INDEX_PATH")
+DPR_INDEXER = os.environ.get("DPR_INDEXER", "flat")
+DPR_PASSAGES = os.environ.get("DPR_PASSAGES")
+DPR_ID_PREFIX = os.environ.get("DPR_ID_PREFIX")
+# SQLite copy of the passages, built from DPR_PASSAGES on first use
+# (default: next to the TSV, as <passages file>.sqlite)
+DPR_PASSAGES_DB = os.environ.get("DPR_PASSAGES_DB")
+
+# Stands in for the missing results of a search that found fewer than n_docs
+# passages: an empty passage, whose vector is the question's scaled by
+# -MISSING_DOC_SCALE so that it scores far below every real passage
+MISSING_DOC = BiEncoderPassage("", "")
+MISSING_DOC_SCALE = 1e4
+
+INDEXERS = {
+    "flat": DenseFlatIndexer,
+    "hnsw": DenseHNSWFlatIndexer,
+    "hnsw_sq": DenseHNSWSQIndexer,
+    "ivf_pq": DenseIVFPQIndexer,
+    "opq_ivf_pq": DenseOPQIVFPQIndexer,
+}
+
+
+# Function to load a serialized DPR index of the given type
+def load_dpr_indexer(index_path, indexer_name=DPR_INDEXER):
+    indexer = INDEXERS[indexer_name]()
+    # memory-mapped where faiss supports it (IVF indexes) and for the id mapping: pages
+    # are loaded on demand and shared by every process serving the same index
+    indexer.deserialize(index_path, mmap=True)
+    if isinstance(indexer, DenseIVFPQIndexer):
+        # DPRIndex reconstructs the retrieved vectors by id, which IVF indexes
+        # only support with a direct map (8 bytes per vector)
+        faiss.extract_index_ivf(indexer.index).make_direct_map()
+    return indexer
+
+
+# Passages of a DPR TSV file in an SQLite table keyed by db id, so a process
+# only holds the passages it retrieves instead of the whole corpus (tens of GB
+# of Python objects for wiki-scale files). The table is built once from the
+# TSV with CsvCtxSrc and rebuilt when the TSV or the id prefix change.
+class PassageStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def __getitem__(self, db_id):
+        return self.get_many([db_id])[0]
+
+    def get_many(self, db_ids):
+        keys = [str(db_id) for db_id in db_ids]
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            # stay below SQLite's limit on bound parameters
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT id, text, title FROM passages WHERE id IN ({marks})", batch)
+                found.update((db_id, BiEncoderPassage(text, title)) for db_id, text, title in rows)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            raise KeyError(missing[0])
+        return [found[key] for key in keys]
+
+
+# Collects the passages CsvCtxSrc.load_data_to produces and inserts them in batches
+class _PassageWriter:
+    def __init__(self, conn, batch_size=10000):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.rows = []
+
+    def __setitem__(self, db_id, passage):
+        self.rows.append((str(db_id), passage.text, passage.title))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.conn.executemany("INSERT OR REPLACE INTO passages (id, text, title) VALUES (?, ?, ?)", self.rows)
+        self.rows = []
+
+
+# Function to build the SQLite passage table from a DPR TSV file
+def build_passage_store(passages_file, db_path, id_prefix=None):
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    conn = sqlite3.connect(tmp_path)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE passages (id TEXT PRIMARY KEY, text TEXT NOT NULL, title TEXT NOT NULL)")
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            writer = _PassageWriter(conn)
+            CsvCtxSrc(passages_file, id_prefix=id_prefix).load_data_to(writer)
+            writer.flush()
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", _source_meta(passages_file, id_prefix))
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+
+
+def _source_meta(passages_file, id_prefix):
+    stat = os.stat(passages_file)
+    return [("size", str(stat.st_size)), ("mtime", str(stat.st_mtime)), ("id_prefix", id_prefix or "")]
+
+
+def _is_current(db_path, passages_file, id_prefix):
+    if not os.path.isfile(db_path):
+        return False
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        meta = sorted(conn.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+    return meta == sorted(_source_meta(passages_file, id_prefix))
+
+
+# Function to open the passages of a DPR TSV file as a PassageStore, building
+# (or rebuilding) its SQLite table first when needed
+def load_passages(passages_file, id_prefix=DPR_ID_PREFIX, db_path=DPR_PASSAGES_DB):
+    db_path = db_path or passages_file + ".sqlite"
+    if not _is_current(db_path, passages_file, id_prefix):
+        build_passage_store(passages_file, db_path, id_prefix)
+    return PassageStore(db_path)
+
+
+# RAG retrieval index backed by a DPR DenseIndexer and its passages. It returns
+# the same (doc ids, doc embeddings) and doc dicts as the HF wiki_dpr index, so
+# RagRetriever builds the usual context_input_ids from it. The index must hold
+# passages encoded with a context encoder matching RAG's question encoder
+# (e.g. the DPR NQ checkpoints).
+class DPRIndex(Index):
+    def __init__(self, indexer, passages):
+        self.indexer = indexer
+        self.passages = passages
+
+    def is_initialized(self):
+        return True
+
+    def init_index(self):
+        pass
+
+    def search(self, question_hidden_states, n_docs):
+        # faiss ids (positions in the index) rather than search_knn's external ids,
+        # so the document vectors can be reconstructed
+        query = np.ascontiguousarray(question_hidden_states, dtype="float32")
+        if isinstance(self.indexer, DenseHNSWFlatIndexer):
+            # same DOT -> L2 conversion as DenseHNSWFlatIndexer.search_knn
+            query = np.hstack((query, np.zeros((len(query), 1), dtype="float32")))
+        _, ids = self.indexer.index.search(query, n_docs)
+        return ids
+
+    def get_top_docs(self, question_hidden_states, n_docs=5):
+        ids = self.search(question_hidden_states, n_docs)
+        dim = question_hidden_states.shape[1]
+        vectors = self.indexer.index.reconstruct_batch(np.maximum(ids, 0).reshape(-1))[:, :dim]
+        vectors = vectors.reshape(len(ids), n_docs, dim)
+        # -1 marks missing results when the index holds fewer than n_docs vectors.
+        # RAG needs n_docs documents per question, so these slots are kept with
+        # MISSING_DOC, which gets no weight in the doc_scores softmax.
+        missing = ids < 0
+        if missing.any():
+            vectors[missing] = -MISSING_DOC_SCALE * question_hidden_states[np.nonzero(missing)[0]]
+        return ids, vectors
+
+    def get_doc_dicts(self, doc_ids):
+        doc_dicts = []
+        for row in self.indexer.get_id_mapping().translate(doc_ids):
+            found = iter(self.passages.get_many([db_id for db_id in row if db_id is not None]))
+            docs = [next(found) if db_id is not None else MISSING_DOC for db_id in row]
+            doc_dicts.append({"title": [doc.title for doc in docs], "text": [doc.text for doc in docs]})
+        return doc_dicts
+
+
+# Function to build the RAG index over local DPR artifacts
+def build_dpr_index(index_path=DPR_INDEX_PATH, indexer_name=DPR_INDEXER, passages_file=DPR_PASSAGES,
+                    id_prefix=DPR_ID_PREFIX, passages_db=DPR_PASSAGES_DB):
+    return DPRIndex(load_dpr_indexer(index_path, indexer_name), load_passages(passages_file, id_prefix, passages_db))
+
+
+# Function to build a RagRetriever over local DPR artifacts
+def build_dpr_retriever(config, tokenizer, **kwargs):
+    return RagRetriever(config, tokenizer.question_encoder, tokenizer.generator, index=build_dpr_index(**kwargs))
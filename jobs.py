@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+# State of one background job. The worker appends partial results as they are
+# ready and the page reads them on every rerun.
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.partials = []
+        self.done_units = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        # request trace (see tracing.Trace) the worker records into, if any
+        self.trace = None
+        self._lock = threading.Lock()
+
+    def add_partial(self, partial):
+        with self._lock:
+            self.partials.append(partial)
+            self.done_units += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "partials": list(self.partials),
+                "done_units": self.done_units,
+                "result": self.result,
+                "error": self.error,
+                "elapsed": (self.finished or time.time()) - self.created,
+            }
+
+
+# Runs jobs on a bounded thread pool shared by every session of the process.
+# Submitting a key whose job is queued, running or done returns the existing
+# job, so a rerun (or a second user with the same document) reattaches instead
+# of starting the work again; only a failed job is replaced by a new one.
+# Finished jobs are kept for keep_seconds.
+class JobExecutor:
+    def __init__(self, max_workers=2, max_pending=16, keep_seconds=3600):
+        self.max_pending = max_pending
+        self.keep_seconds = keep_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summ-job")
+        self._jobs = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self._lock:
+            self._forget_old()
+            job = self._jobs.get(self._by_key.get(key))
+            if job is not None and job.status != "failed":
+                return job.id
+            pending = sum(1 for j in self._jobs.values() if j.status in ("queued", "running"))
+            if pending >= self.max_pending:
+                raise QueueFullError("Too many documents are being processed, please try again shortly.")
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, key):
+        with self._lock:
+            return self._jobs.get(self._by_key.get(key))
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+
+    def _forget_old(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished > self.keep_seconds:
+                del self._jobs[job_id]
+                if self._by_key.get(job.key) == job_id:
+                    del self._by_key[job.key]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = JobExecutor(
+                max_workers=int(os.environ.get("SUMM_JOB_WORKERS", "2")),
+                max_pending=int(os.environ.get("SUMM_JOB_QUEUE", "16")),
+            )
+        return _executor
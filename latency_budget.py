@@ -0,0 +1,102 @@
+import math
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+QASettings = namedtuple("QASettings", ["n_docs", "num_beams", "max_new_tokens"])
+
+# Settings tried from best quality to cheapest; the last one (greedy decoding
+# over 5 docs) is used whenever nothing else fits the budget
+SETTINGS_LADDER = [
+    QASettings(10, 4, 64),
+    QASettings(5, 4, 64),
+    QASettings(5, 2, 48),
+    QASettings(5, 1, 32),
+]
+
+
+def settings_cost(settings):
+    return settings.n_docs * settings.num_beams * settings.max_new_tokens
+
+
+# Keeps the per-question latencies observed on this machine for each setting
+# and picks the best setting whose estimated p95 fits a target. Settings that
+# have not been measured are extrapolated from the measured ones in proportion
+# to n_docs * num_beams * max_new_tokens. Latencies and targets are per question;
+# estimates are multiplied by the number of requests in flight, since
+# concurrent requests share the same CPU/GPU.
+class LatencyBudget:
+    def __init__(self, ladder=SETTINGS_LADDER, window=50):
+        self.ladder = ladder
+        self.window = window
+        self._samples = {settings: deque(maxlen=window) for settings in ladder}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def estimate_p95(self, settings):
+        with self._lock:
+            return self._estimate_p95(settings)
+
+    def choose(self, target_p95):
+        with self._lock:
+            load = self._in_flight + 1
+            for settings in self.ladder:
+                estimate = self._estimate_p95(settings)
+                if estimate is not None and estimate * load <= target_p95:
+                    return settings
+            return self.ladder[-1]
+
+    # Context manager timing a request of n_questions. It yields a dict whose
+    # "n_questions" may be updated to the number of questions that were really
+    # generated (e.g. not answered from a cache); nothing is recorded for 0.
+    @contextmanager
+    def track(self, settings, n_questions=1):
+        sample = {"n_questions": n_questions}
+        with self._lock:
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield sample
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._in_flight -= 1
+                if sample["n_questions"] > 0:
+                    samples = self._samples.setdefault(settings, deque(maxlen=self.window))
+                    samples.append(elapsed / sample["n_questions"])
+
+    def calibrate(self, run, runs=1):
+        # run(settings) answers a probe question with the given settings and
+        # records its latency with track()
+        for settings in self.ladder:
+            for _ in range(runs):
+                run(settings)
+
+    def _estimate_p95(self, settings):
+        samples = self._samples.get(settings)
+        if samples:
+            return _p95(samples)
+        measured = [(s, _p95(v)) for s, v in self._samples.items() if v and s.max_new_tokens]
+        if not measured:
+            return None
+        reference, p95 = min(measured, key=lambda m: abs(settings_cost(m[0]) - settings_cost(settings)))
+        return p95 * settings_cost(settings) / settings_cost(reference)
+
+
+def _p95(samples):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_latency_budget():
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = LatencyBudget(window=int(os.environ.get("QA_LATENCY_WINDOW", "50")))
+        return _budget
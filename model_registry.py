@@ -0,0 +1,141 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# Process-wide cache of loaded pipelines, keyed by (task, model, dtype).
+# Every Streamlit session in the same server process shares one registry, so
+# weights are read from disk once and each rerun only pays for inference.
+class ModelRegistry:
+    def __init__(self, max_models=2, loader=None):
+        self.max_models = max_models
+        self.loader = loader or load_pipeline
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, task, model, dtype="float32", warmup=True):
+        return self._get((task, model, dtype), warmup)
+
+    @contextmanager
+    def use(self, task, model, dtype="float32"):
+        # Holding a reference keeps the model from being evicted mid-request
+        key = (task, model, dtype)
+        pipe = self._get(key, acquire=True)
+        try:
+            yield pipe
+        finally:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry["refs"] -= 1
+                self._evict()
+
+    def _get(self, key, warmup=True, acquire=False):
+        # The reference is taken under the registry lock, together with the
+        # lookup, so the entry cannot be evicted before the caller holds it
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry["refs"] += acquire
+                return entry["pipeline"]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so other models stay available,
+        # but only once per key even if several sessions ask at the same time
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry["refs"] += acquire
+                    return entry["pipeline"]
+            pipe = self.loader(*key)
+            if warmup:
+                warm_up(pipe, key[0])
+            with self._lock:
+                self._entries[key] = {"pipeline": pipe, "refs": int(acquire)}
+                # the new model stays even if every older one is in use; the
+                # registry is then over max_models until one is released
+                self._evict(keep=key)
+            return pipe
+
+    def loaded(self):
+        with self._lock:
+            return [
+                {"task": k[0], "model": k[1], "dtype": k[2], "refs": v["refs"]}
+                for k, v in self._entries.items()
+            ]
+
+    def unload(self, task, model, dtype="float32"):
+        with self._lock:
+            entry = self._entries.get((task, model, dtype))
+            if entry is not None and entry["refs"] == 0:
+                del self._entries[(task, model, dtype)]
+                self._key_locks.pop((task, model, dtype), None)
+                return True
+            return False
+
+    def _evict(self, keep=None):
+        # Drop least recently used models that nobody is currently using
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_models:
+                break
+            if key != keep and self._entries[key]["refs"] == 0:
+                del self._entries[key]
+                self._key_locks.pop(key, None)
+
+
+# Function to build a transformers pipeline for a registry key. dtype "qint8" is
+# the CPU backend: the fp32 model with its Linear layers dynamically quantized
+# to int8 (weights stored as int8, activations quantized on the fly).
+def load_pipeline(task, model, dtype):
+    # transformers takes seconds to import; only pay for it when a model is loaded
+    from transformers import pipeline
+
+    if dtype == "float32":
+        return pipeline(task, model=model)
+    import torch
+    if dtype == "qint8":
+        pipe = pipeline(task, model=model, device=-1)
+        pipe.model = torch.quantization.quantize_dynamic(pipe.model, {torch.nn.Linear}, dtype=torch.qint8)
+        return pipe
+    return pipeline(task, model=model, torch_dtype=getattr(torch, dtype))
+
+
+# Function to pin torch's CPU thread pools. Inter-op threads can only be set
+# before the first parallel op runs, so call this before loading any model.
+def configure_threads(intra_op=None, inter_op=None):
+    if not intra_op and not inter_op:
+        return
+    import torch
+    if intra_op:
+        torch.set_num_threads(int(intra_op))
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(int(inter_op))
+        except RuntimeError:
+            # already started; keep torch's current setting
+            pass
+
+
+# Function to run one tiny input through a freshly loaded pipeline so the first
+# real request does not pay for lazy initialisation
+def warm_up(pipe, task):
+    if task == "summarization":
+        pipe("Warm up the summarization model.", max_length=8, min_length=1, do_sample=False)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(max_models=2):
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            configure_threads(os.environ.get("SUMM_INTRA_OP_THREADS"), os.environ.get("SUMM_INTER_OP_THREADS"))
+            _registry = ModelRegistry(max_models=max_models)
+        return _registry
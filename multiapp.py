@@ -1,20 +1,40 @@
+import importlib
+import time
+
 import streamlit as st
 
 class MultiApp:
     def __init__(self):
         self.apps = []
+        self.timings = {}
 
+    # func is a callable, or a "module:function" string that is only imported
+    # the first time its page is selected, so heavy page dependencies do not
+    # slow down app startup
     def add_app(self, title, func):
         self.apps.append({
             "title": title,
             "function": func
         })
 
+    def load(self, app):
+        if isinstance(app['function'], str):
+            module_name, _, function_name = app['function'].partition(':')
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            self.timings[f"import {module_name}"] = time.perf_counter() - start
+            app['function'] = getattr(module, function_name)
+        return app['function']
+
     def run(self):
         app = st.sidebar.radio(
             'Navigation',
             self.apps,
             format_func=lambda app: app['title'])
 
-        app['function']()
-
+        func = self.load(app)
+        start = time.perf_counter()
+        try:
+            func()
+        finally:
+            self.timings[f"render {app['title']}"] = time.perf_counter() - start
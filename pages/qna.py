@@ -1,58 +1,154 @@
+import csv
+import io
+import os
+
 import streamlit as st
-from transformers import RagTokenizer, RagRetriever, RagSequenceForGeneration
-from datasets import load_dataset
 
-st.title("Simple Q&A with RAG")
-st.write("Ask a question and get an answer!")
+from latency_budget import QASettings, get_latency_budget
+from tracing import Trace, activate, export_trace, format_waterfall
+
+# Questions answered per model.generate call in multi-question mode
+QA_BATCH_SIZE = int(os.environ.get("QA_BATCH_SIZE", "16"))
+# Default p95 latency target (seconds per question) for the latency budget mode
+QA_TARGET_P95 = float(os.environ.get("QA_TARGET_P95", "5.0"))
+# Question used to measure each setting of the latency budget ladder
+CALIBRATION_QUESTION = "who wrote the play romeo and juliet"
 
-@st.cache(allow_output_mutation=True)
+# Loaded once per server process and shared by all sessions; the passages and
+# index come memory-mapped from a prepared directory when one exists.
+# Failures are not cached, so the next rerun tries again.
+@st.cache_resource(show_spinner="Loading RAG model...")
 def load_rag_model():
+    # transformers, datasets and torch are only imported once the page is used
+    from rag_loader import load_rag_components
+
+    return load_rag_components()
+
+# Function to read questions from pasted text (one per line) or an uploaded CSV
+# (a "question" column, or the first column)
+def read_questions(text, csv_file):
+    if csv_file is not None:
+        rows = list(csv.reader(io.StringIO(csv_file.getvalue().decode("utf-8"))))
+        if not rows:
+            return []
+        header = [h.strip().lower() for h in rows[0]]
+        column = header.index("question") if "question" in header else 0
+        body = rows[1:] if "question" in header else rows
+        return [row[column].strip() for row in body if len(row) > column and row[column].strip()]
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+# Function to show the retrieval depth / generation budget controls. Returns a
+# function giving the settings for the next request: set by hand, or in latency
+# budget mode picked from a target p95 latency per question using the timings
+# measured in this process (degrading to greedy decoding over 5 docs).
+def settings_controls(budget, answer):
+    st.sidebar.subheader("Answer settings")
+    if st.sidebar.checkbox("Latency budget mode"):
+        target = st.sidebar.number_input("Target p95 latency per question (s)", 0.1, 120.0, QA_TARGET_P95)
+        if st.sidebar.button("Measure latency on this machine"):
+            with st.spinner("Measuring..."):
+                budget.calibrate(lambda s: answer([CALIBRATION_QUESTION], s, use_cache=False))
+        settings = budget.choose(target)
+        estimate = budget.estimate_p95(settings)
+        st.sidebar.caption(f"Using {settings.n_docs} docs, {settings.num_beams} beams, "
+                           f"{settings.max_new_tokens} new tokens"
+                           + (f" (p95 ~{estimate:.1f}s per question)" if estimate else " (not measured yet)"))
+        return lambda: budget.choose(target)
+
+    n_docs = st.sidebar.number_input("Retrieved documents", 1, 50, 5)
+    num_beams = st.sidebar.number_input("Beams", 1, 16, 4)
+    max_new_tokens = st.sidebar.number_input("Max new tokens (0 = model default)", 0, 512, 0)
+    settings = QASettings(n_docs, num_beams, max_new_tokens or None)
+    return lambda: settings
+
+# Main function for the Streamlit app
+def qna_page():
+    st.title("Simple Q&A with RAG")
+    st.write("Ask a question and get an answer!")
+
     try:
-        # Load the tokenizer
-        tokenizer = RagTokenizer.from_pretrained("facebook/rag-sequence-nq")
-        
-        # Load the dataset with trust_remote_code=True and specify the config
-        dataset = load_dataset("wiki_dpr", "psgs_w100.nq.exact", split="train", trust_remote_code=True)
-        
-        # Load the retriever with the dataset
-        retriever = RagRetriever.from_pretrained(
-            "facebook/rag-sequence-nq", 
-            index_name="exact", 
-            passages_path=None, 
-            dataset=dataset
-        )
-        
-        # Load the model
-        model = RagSequenceForGeneration.from_pretrained("facebook/rag-sequence-nq")
-        
-        return tokenizer, retriever, model
+        tokenizer, retriever, model, load_timings = load_rag_model()
     except Exception as e:
         st.error(f"Error loading RAG model: {e}")
-        return None, None, None
-
-tokenizer, retriever, model = load_rag_model()
-
-if tokenizer and retriever and model:
-    question = st.text_input("Enter your question:")
-
-    if st.button("Get Answer"):
-        if question:
-            inputs = tokenizer(question, return_tensors="pt")
-            
-            # Retrieve documents
-            question_inputs = tokenizer(question, return_tensors="pt")
-            retrieved_docs = retriever(question_inputs.input_ids)
-            context_input_ids = retrieved_docs['context_input_ids']
-            context_attention_mask = retrieved_docs['context_attention_mask']
-            
-            inputs['context_input_ids'] = context_input_ids
-            inputs['context_attention_mask'] = context_attention_mask
-
-            # Generate the answer
-            outputs = model.generate(**inputs, num_beams=4, num_return_sequences=1)
-            answer = tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
-            st.write(f"Answer: {answer}")
-        else:
-            st.write("Please enter a question.")
-else:
-    st.write("Failed to load the RAG model. Please check the error message above.")
+        st.write("Failed to load the RAG model. Please check the error message above.")
+        return
+
+    st.sidebar.caption("RAG load time: " + ", ".join(f"{name} {seconds:.1f}s"
+                                                      for name, seconds in load_timings.items()))
+
+    from answer_cache import get_answer_cache
+    from rag_qa import answer_questions
+    from retrieval_cache import get_retrieval_cache
+
+    answer_cache = get_answer_cache()
+    retrieval_cache = get_retrieval_cache()
+    latency_budget = get_latency_budget()
+
+    # Function to answer questions with the given settings, recording the latency
+    # per generated question (requests answered from the cache are not timed)
+    def answer(questions, settings, use_cache=True, **kwargs):
+        stats = {"generated": 0}
+        with latency_budget.track(settings, 0) as sample:
+            answers = answer_questions(questions, tokenizer, retriever, model, num_beams=settings.num_beams,
+                                       n_docs=settings.n_docs, max_new_tokens=settings.max_new_tokens,
+                                       cache=answer_cache if use_cache else None,
+                                       retrieval_cache=retrieval_cache if use_cache else None, stats=stats,
+                                       **kwargs)
+            sample["n_questions"] = stats["generated"]
+        return answers
+
+    # Function to answer a user request under a new trace (kept for the debug sidebar)
+    def answer_traced(questions, settings, **kwargs):
+        trace = Trace("qna", questions=len(questions), n_docs=settings.n_docs, num_beams=settings.num_beams)
+        try:
+            with activate(trace):
+                return answer(questions, settings, **kwargs)
+        finally:
+            st.session_state["qna_trace"] = export_trace(trace)
+
+    settings_for = settings_controls(latency_budget, answer)
+    mode = st.radio("Mode", ["Single question", "Multiple questions"], horizontal=True)
+
+    if mode == "Single question":
+        question = st.text_input("Enter your question:")
+
+        if st.button("Get Answer"):
+            if question:
+                result = answer_traced([question], settings_for())[0]
+                st.write(f"Answer: {result}")
+            else:
+                st.write("Please enter a question.")
+    else:
+        questions_text = st.text_area("Enter one question per line:")
+        questions_csv = st.file_uploader("...or upload a CSV with a 'question' column", type=["csv"])
+
+        if st.button("Get Answers"):
+            questions = read_questions(questions_text, questions_csv)
+            if questions:
+                # One retrieval call and batched generation for all questions
+                with st.spinner(f"Answering {len(questions)} questions..."):
+                    answers = answer_traced(questions, settings_for(), batch_size=QA_BATCH_SIZE)
+                results = [{"question": q, "answer": a} for q, a in zip(questions, answers)]
+                st.dataframe(results, use_container_width=True)
+
+                output = io.StringIO()
+                writer = csv.DictWriter(output, fieldnames=["question", "answer"])
+                writer.writeheader()
+                writer.writerows(results)
+                st.download_button("Download answers (CSV)", output.getvalue(), "answers.csv", "text/csv")
+            else:
+                st.write("Please enter at least one question.")
+
+    # Per-request stage timings of the last request (SUMM_TRACE_PATH also exports them to a file)
+    if st.sidebar.checkbox("Show request trace") and "qna_trace" in st.session_state:
+        st.sidebar.code(format_waterfall(st.session_state["qna_trace"]))
+
+    stats = answer_cache.stats()
+    st.sidebar.caption(f"Answer cache: {stats['exact_hits']} exact hits, {stats['similar_hits']} near-duplicate "
+                       f"hits, {stats['misses']} misses, {stats['entries']} entries")
+    stats = retrieval_cache.stats()
+    st.sidebar.caption(f"Retrieval cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} "
+                       f"entries ({stats['bytes'] / 2 ** 20:.1f} MB)")
+
+if __name__ == "__main__":
+    qna_page()
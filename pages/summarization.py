@@ -1,62 +1,215 @@
+import io
+import os
+import time
+
 import streamlit as st
-import fitz  # PyMuPDF for PDF reading
 import docx2txt
-from transformers import pipeline
+
+from chunking import final_summary, iter_map_reduce, iter_summaries
+from jobs import QueueFullError, get_executor
+from model_registry import get_registry
+from pdf_extraction import extract_pdf_text
+from summary_cache import content_key, get_summary_cache
+from tracing import Trace, activate, export_trace, format_waterfall, span, traced_iter
+
+# Summarizer models that can be selected on the page (comma separated), and how
+# many of them may stay loaded in this process at the same time
+SUMMARIZER_MODELS = os.environ.get("SUMM_MODELS", "t5-small").split(",")
+MAX_LOADED_MODELS = int(os.environ.get("SUMM_MAX_LOADED_MODELS", "2"))
+# Model precision for this deployment: "float32", or "qint8" for the dynamically
+# quantized CPU backend (thread counts: SUMM_INTRA_OP_THREADS / SUMM_INTER_OP_THREADS)
+MODEL_DTYPE = os.environ.get("SUMM_DTYPE", "float32")
+# Default number of processes used to extract text from PDFs (1 = serial)
+PDF_WORKERS = int(os.environ.get("SUMM_PDF_WORKERS", "1"))
+# Generation settings for every chunk; part of the summary cache keys
+GENERATION_KWARGS = {"max_length": 150, "min_length": 30, "do_sample": False}
+# How often the page redraws a running summarization job
+JOB_POLL_SECONDS = 0.25
 
 # Function to read PDF and extract text
-def read_pdf(file):
-    doc = fitz.open(stream=file.read(), filetype="pdf")
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
+def read_pdf(file, workers=1, page_range=None):
+    return "".join(extract_pdf_text(file, workers=workers, page_range=page_range))
 
 # Function to read DOCX and extract text
 def read_docx(file):
     return docx2txt.process(file)
 
-# Function to summarize text using T5 model
-def summarize_text_t5(text, summarizer):
+# Function to remember the pieces of a text stream while passing them on
+def collect_pieces(pieces, sink):
+    for piece in pieces:
+        sink.append(piece)
+        yield piece
+
+# Function to summarize a document (a string or an iterator of page texts) with
+# the T5 pipeline, yielding each chunk summary (and, in map-reduce mode, each
+# summary of every level) as soon as it is ready
+def iter_document_summaries(text, summarizer, batch_size=8, map_reduce=None, chunk_store=None):
+    if isinstance(text, str) and not text.strip():
+        return iter(())
+    # Recursively summarize the summaries of very long documents
+    if map_reduce:
+        return iter_map_reduce(text, summarizer, batch_size=batch_size, chunk_store=chunk_store,
+                               content_defined=chunk_store is not None, **map_reduce, **GENERATION_KWARGS)
+    # Split text on sentence boundaries into chunks that fit the model's token budget.
+    # Text may also be an iterator of pages, which is chunked as it is extracted.
+    # When chunk summaries are cached, boundaries are content-defined so that an
+    # edited document keeps the chunks (and summaries) of its unchanged parts.
+    return iter_summaries(text, summarizer, batch_size=batch_size, chunk_store=chunk_store,
+                          content_defined=chunk_store is not None, **GENERATION_KWARGS)
+
+# Function run by the background job executor: extract (or reuse cached) text,
+# summarize it and store the results in the summary cache. Each stage is
+# recorded into the job's trace, which is exported when the job ends.
+def run_summary_job(job, file_bytes, file_type, model_name, map_reduce, pdf_workers, page_range,
+                    text_key, summary_key, trace=None):
+    job.trace = trace = trace or Trace("summarization")
     try:
-        if not text.strip():
-            return ""
-        # Split text into chunks that fit model's max_length
-        max_chunk_size = 512
-        chunks = [text[i:i + max_chunk_size] for i in range(0, len(text), max_chunk_size)]
-        summaries = [summarizer(chunk, max_length=150, min_length=30, do_sample=False)[0]['summary_text'] for chunk in chunks]
-        return " ".join(summaries)
-    except Exception as e:
-        st.error(f"Error summarizing text: {e}")
-        return None
+        with activate(trace):
+            return summarize_upload(job, file_bytes, file_type, model_name, map_reduce, pdf_workers, page_range,
+                                    text_key, summary_key)
+    finally:
+        export_trace(trace)
+
+# Function to summarize an uploaded document within a job
+def summarize_upload(job, file_bytes, file_type, model_name, map_reduce, pdf_workers, page_range,
+                     text_key, summary_key):
+    cache = get_summary_cache()
+    with span("text cache lookup"):
+        document_text = cache.get("text", text_key)
+    extracted = None
+    if document_text is None:
+        extracted = []
+        if file_type == "pdf":
+            # pages are extracted as chunking pulls them, so these spans nest under "chunking"
+            document_text = collect_pieces(
+                traced_iter(extract_pdf_text(io.BytesIO(file_bytes), workers=pdf_workers, page_range=page_range),
+                            "extraction"),
+                extracted)
+        else:
+            with span("extraction"):
+                document_text = read_docx(io.BytesIO(file_bytes))
+            extracted.append(document_text)
+
+    registry = get_registry(max_models=MAX_LOADED_MODELS)
+    with span("model load"):
+        registry.get("summarization", model_name, MODEL_DTYPE)
+    with registry.use("summarization", model_name, MODEL_DTYPE) as summarizer_t5:
+        chunk_store = cache.chunk_store(model=model_name, dtype=MODEL_DTYPE, generation=GENERATION_KWARGS)
+        partials = []
+        for partial in iter_document_summaries(document_text, summarizer_t5, map_reduce=map_reduce,
+                                               chunk_store=chunk_store):
+            partials.append(partial)
+            job.add_partial(partial)
+        summary = final_summary(partials)
+
+    with span("cache store"):
+        if extracted is not None:
+            cache.put("text", text_key, "".join(extracted))
+        if summary:
+            cache.put("summary", summary_key, summary)
+    return summary
+
+# Function to render the state of a summarization job into a placeholder
+def render_summary_job(state):
+    if state["status"] == "failed":
+        st.error(f"Error summarizing text: {state['error']}")
+        return
+    if state["status"] == "done":
+        if state["result"]:
+            st.subheader("Summary (T5):")
+            st.write(state["result"])
+        return
+
+    if state["status"] == "queued":
+        st.info("Waiting for a free summarization worker...")
+    else:
+        st.info(f"Summarizing... {state['done_units']} chunk summaries ready ({state['elapsed']:.0f}s)")
+    # Show summaries as they arrive, in document order within each level
+    levels = {}
+    for partial in sorted(state["partials"]):
+        levels.setdefault(partial.level, []).append(partial.text)
+    for level, texts in levels.items():
+        if level > 0:
+            st.caption(f"Summary of summaries, level {level}")
+        st.write(" ".join(texts))
+
+# Function to follow a summarization job, redrawing partial summaries as they arrive
+def show_summary_job(job):
+    placeholder = st.empty()
+    while True:
+        state = job.snapshot()
+        with placeholder.container():
+            render_summary_job(state)
+        if state["status"] in ("done", "failed"):
+            return
+        time.sleep(JOB_POLL_SECONDS)
 
 # Main function for the Streamlit app
 def summarization_page():
     st.title("Text Summarization with T5")
 
+    model_name = SUMMARIZER_MODELS[0]
+    if len(SUMMARIZER_MODELS) > 1:
+        model_name = st.selectbox("Model", SUMMARIZER_MODELS)
+
+    map_reduce = None
+    if st.checkbox("Hierarchical summary for very long documents"):
+        map_reduce = {
+            "target_tokens": st.number_input("Target summary length (tokens)", 64, 4096, 512),
+            "fan_in": st.number_input("Summaries combined per step", 2, 16, 4),
+            "max_depth": st.number_input("Maximum reduce levels", 1, 10, 3),
+        }
+
+    with st.expander("PDF extraction"):
+        pdf_workers = st.number_input("Extraction worker processes", 1, os.cpu_count() or 1,
+                                      min(PDF_WORKERS, os.cpu_count() or 1))
+        first_page = st.number_input("First page", 1, value=1)
+        last_page = st.number_input("Last page (0 = last page of the document)", 0, value=0)
+
+    # Per-request stage timings (SUMM_TRACE_PATH also exports them to a file)
+    show_trace = st.sidebar.checkbox("Show request trace")
+
     # Upload document
     uploaded_file = st.file_uploader("Upload a PDF or DOCX file", type=["pdf", "docx"])
     if uploaded_file is not None:
         file_type = uploaded_file.name.split('.')[-1]
-
-        # Read PDF or DOCX and extract text
-        if file_type == "pdf":
-            document_text = read_pdf(uploaded_file)
-        elif file_type == "docx":
-            document_text = read_docx(uploaded_file)
-        else:
+        if file_type not in ("pdf", "docx"):
             st.error("Unsupported file format. Please upload a PDF or DOCX file.")
             return
-        
-        # Initialize T5 summarizer pipeline
-        summarizer_t5 = pipeline("summarization", model="t5-small")
-
-        # Summarize the extracted text
-        with st.spinner("Summarizing text..."):
-            summary_t5 = summarize_text_t5(document_text, summarizer_t5)
-        
+
+        # Repeat uploads of the same bytes are served from the summary cache
+        cache = get_summary_cache()
+        trace = Trace("summarization", file_type=file_type, model=model_name)
+        with trace.span("read upload"):
+            file_bytes = uploaded_file.getvalue()
+        page_range = (first_page, last_page) if file_type == "pdf" else None
+        text_key = content_key(file_bytes, file_type=file_type, page_range=page_range)
+        summary_key = content_key(file_bytes, file_type=file_type, page_range=page_range, model=model_name,
+                                  dtype=MODEL_DTYPE, generation=GENERATION_KWARGS, map_reduce=map_reduce)
+        with trace.span("summary cache lookup"):
+            summary_t5 = cache.get("summary", summary_key)
         if summary_t5:
             st.subheader("Summary (T5):")
             st.write(summary_t5)
+            export_trace(trace)
+            if show_trace:
+                st.sidebar.code(format_waterfall(trace))
+            return
+
+        # Extraction and inference run in the background; reruns (and other users
+        # uploading the same document) reattach to its queued, running or finished
+        # job, while a document whose last job failed is tried again
+        executor = get_executor()
+        try:
+            job = executor.get(executor.submit(
+                summary_key, run_summary_job, file_bytes, file_type, model_name, map_reduce,
+                pdf_workers, page_range, text_key, summary_key, trace))
+        except QueueFullError as e:
+            st.error(str(e))
+            return
+        show_summary_job(job)
+        if show_trace and job.trace is not None:
+            st.sidebar.code(format_waterfall(job.trace))
 
 if __name__ == "__main__":
     summarization_page()
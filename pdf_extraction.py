@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+
+# Function to open a PDF from a path or an uploaded file object
+def open_pdf(file):
+    import fitz  # PyMuPDF for PDF reading, imported on first use to keep app startup fast
+
+    if isinstance(file, str):
+        return fitz.open(file)
+    data = file.getvalue() if hasattr(file, "getvalue") else file.read()
+    return fitz.open(stream=data, filetype="pdf")
+
+
+# Function to turn an optional (first, last) page range into zero-based start/end.
+# Pages are numbered from 1 and last is inclusive; None or 0 means "to the end".
+def resolve_page_range(page_count, page_range=None):
+    if not page_range:
+        return 0, page_count
+    first, last = page_range
+    start = max((first or 1) - 1, 0)
+    end = min(last or page_count, page_count)
+    return start, max(start, end)
+
+
+# Function to extract PDF text lazily, yielding the text of pages_per_batch pages
+# at a time so chunking and summarization can start before the last page is parsed
+def iter_pdf_text(file, pages_per_batch=8, page_range=None):
+    with open_pdf(file) as doc:
+        start, end = resolve_page_range(doc.page_count, page_range)
+        for batch_start in range(start, end, pages_per_batch):
+            batch_end = min(batch_start + pages_per_batch, end)
+            yield "".join(doc[i].get_text() for i in range(batch_start, batch_end))
+
+
+# Function to extract PDF text with a pool of worker processes. Page ranges are
+# spread over the workers, each worker opens the document itself by path (an
+# uploaded file is written to a temporary file once, which the workers then
+# read through the shared page cache) and the text of each range is yielded in
+# page order as soon as it and all earlier ranges are done. At most window
+# ranges (2 per worker by default) are in flight, so extracted text does not
+# pile up ahead of a slow consumer.
+def iter_pdf_text_parallel(file, workers=4, pages_per_batch=16, page_range=None, window=None):
+    tmp_path = None
+    if isinstance(file, str):
+        path = file
+    else:
+        data = file.getvalue() if hasattr(file, "getvalue") else file.read()
+        fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        path = tmp_path
+        del data
+
+    try:
+        with open_pdf(path) as doc:
+            start, end = resolve_page_range(doc.page_count, page_range)
+        ranges = iter([(s, min(s + pages_per_batch, end)) for s in range(start, end, pages_per_batch)])
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(path,)) as executor:
+            pending = deque(executor.submit(_extract_range, r) for r in islice(ranges, window or 2 * workers))
+            while pending:
+                text = pending.popleft().result()
+                for r in islice(ranges, 1):
+                    pending.append(executor.submit(_extract_range, r))
+                yield text
+    finally:
+        if tmp_path is not None:
+            os.remove(tmp_path)
+
+
+# Function to pick the serial or the parallel extractor
+def extract_pdf_text(file, workers=1, pages_per_batch=None, page_range=None):
+    if workers and workers > 1:
+        return iter_pdf_text_parallel(file, workers=workers, pages_per_batch=pages_per_batch or 16,
+                                      page_range=page_range)
+    return iter_pdf_text(file, pages_per_batch=pages_per_batch or 8, page_range=page_range)
+
+
+# Each worker process opens the document once and keeps it for all its ranges
+_worker_doc = None
+
+
+def _init_worker(path):
+    global _worker_doc
+    _worker_doc = open_pdf(path)
+
+
+def _extract_range(page_range):
+    return "".join(_worker_doc[i].get_text() for i in range(*page_range))
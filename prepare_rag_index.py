@@ -0,0 +1,39 @@
+"""
+Writes the wiki_dpr passages and their FAISS index to a local directory that
+the Q&A page can memory-map at startup (see rag_loader.py).
+
+    python prepare_rag_index.py [--out ~/.cache/summ/rag_index] [--config psgs_w100.nq.exact]
+"""
+import argparse
+import os
+
+import faiss
+from datasets import load_dataset
+
+from rag_loader import INDEX_FILE, PASSAGES_DIR, RAG_INDEX_DIR
+
+
+# Function to write a passages dataset (title, text, embeddings) and its FAISS
+# index in the layout load_prepared_index reads
+def write_prepared_index(dataset, index, out):
+    os.makedirs(out, exist_ok=True)
+    faiss.write_index(index, os.path.join(out, INDEX_FILE))
+    dataset.save_to_disk(os.path.join(out, PASSAGES_DIR))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=RAG_INDEX_DIR)
+    parser.add_argument("--config", default="psgs_w100.nq.exact")
+    args = parser.parse_args()
+
+    dataset = load_dataset("wiki_dpr", args.config, split="train", trust_remote_code=True)
+
+    index = dataset.get_index("embeddings").faiss_index
+    dataset.drop_index("embeddings")
+    write_prepared_index(dataset, index, args.out)
+    print(f"Wrote {len(dataset)} passages and a {type(index).__name__} index to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import time
+from contextlib import contextmanager
+
+from transformers import RagConfig, RagRetriever, RagSequenceForGeneration, RagTokenizer
+
+RAG_MODEL_NAME = os.environ.get("RAG_MODEL", "facebook/rag-sequence-nq")
+# Directory written by prepare_rag_index.py; when it is missing the wiki_dpr
+# dataset is downloaded/loaded through the datasets cache as before
+RAG_INDEX_DIR = os.environ.get("RAG_INDEX_DIR", os.path.join(os.path.expanduser("~"), ".cache", "summ", "rag_index"))
+PASSAGES_DIR = "passages"
+INDEX_FILE = "index.faiss"
+
+
+@contextmanager
+def timed(timings, name):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+# Function to check whether a prepared index directory is complete
+def has_prepared_index(index_dir=RAG_INDEX_DIR):
+    return os.path.isdir(os.path.join(index_dir, PASSAGES_DIR)) and os.path.isfile(os.path.join(index_dir, INDEX_FILE))
+
+
+# Function to open the prepared passages and FAISS index without reading them
+# into RAM: the Arrow passages are memory-mapped by load_from_disk, and the
+# index by faiss where the index type supports it (IVF indexes only; flat and
+# HNSW indexes are read into RAM)
+def load_prepared_index(config, index_dir=RAG_INDEX_DIR):
+    import faiss
+    from datasets import load_from_disk
+    from datasets.search import FaissIndex
+    from transformers.models.rag.retrieval_rag import CustomHFIndex
+
+    dataset = load_from_disk(os.path.join(index_dir, PASSAGES_DIR), keep_in_memory=False)
+    index_path = os.path.join(index_dir, INDEX_FILE)
+    try:
+        faiss_index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # index types without mmap support are read normally
+        faiss_index = faiss.read_index(index_path)
+    # attach the already built index to the "embeddings" column; add_faiss_index
+    # would re-add every vector to it
+    dataset._indexes["embeddings"] = FaissIndex(custom_index=faiss_index)
+    # without an index_path, CustomHFIndex takes the dataset's attached index as initialized
+    return CustomHFIndex(config.retrieval_vector_size, dataset)
+
+
+# Function to pick the passage index: the shared retrieval service when
+# RETRIEVAL_SERVICE_ADDRESS is set, local DPR artifacts when DPR_INDEX_PATH is
+# set, else a prepared index directory. None means "download wiki_dpr".
+def load_index(config, index_dir=RAG_INDEX_DIR, use_service=True):
+    if use_service and os.environ.get("RETRIEVAL_SERVICE_ADDRESS"):
+        from retrieval_service import RemoteIndex
+
+        return RemoteIndex(os.environ["RETRIEVAL_SERVICE_ADDRESS"])
+    if os.environ.get("DPR_INDEX_PATH"):
+        # local DPR index and passages (requires the dpr package from DPR-main)
+        from dpr_retriever import build_dpr_index
+
+        return build_dpr_index()
+    if has_prepared_index(index_dir):
+        return load_prepared_index(config, index_dir)
+    return None
+
+
+# Function to load tokenizer, retriever and generator, recording the seconds
+# spent on each component in the returned timings dict
+def load_rag_components(model_name=RAG_MODEL_NAME, index_dir=RAG_INDEX_DIR):
+    timings = {}
+    with timed(timings, "tokenizer"):
+        tokenizer = RagTokenizer.from_pretrained(model_name)
+
+    with timed(timings, "index"):
+        config = RagConfig.from_pretrained(model_name)
+        index = load_index(config, index_dir)
+        if index is not None:
+            retriever = RagRetriever(config, tokenizer.question_encoder, tokenizer.generator, index=index)
+        else:
+            from datasets import load_dataset
+
+            # Load the dataset with trust_remote_code=True and specify the config
+            dataset = load_dataset("wiki_dpr", "psgs_w100.nq.exact", split="train", trust_remote_code=True)
+            retriever = RagRetriever.from_pretrained(
+                model_name,
+                index_name="exact",
+                passages_path=None,
+                dataset=dataset
+            )
+
+    with timed(timings, "model"):
+        model = RagSequenceForGeneration.from_pretrained(model_name)
+    return tokenizer, retriever, model, timings
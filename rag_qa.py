@@ -0,0 +1,177 @@
+import torch
+
+from answer_cache import normalize_question
+from tracing import span
+
+
+# Function to tokenize a batch of questions once and run the RAG question encoder
+def encode_questions(questions, tokenizer, model):
+    with span("tokenize", questions=len(questions)):
+        inputs = tokenizer(questions, return_tensors="pt", padding=True, truncation=True)
+    with span("encode", questions=len(questions)), torch.no_grad():
+        hidden_states = model.question_encoder(inputs["input_ids"], attention_mask=inputs["attention_mask"])[0]
+    return {"input_ids": inputs["input_ids"], "attention_mask": inputs["attention_mask"],
+            "hidden_states": hidden_states}
+
+
+# Function to select some questions (rows) of encode_questions output
+def select_encoded(encoded, rows):
+    rows = torch.as_tensor(rows, dtype=torch.long)
+    return {name: value[rows] for name, value in encoded.items()}
+
+
+# Function to retrieve passages for a batch of questions with a single retriever
+# call. The result holds everything generation needs, so the two steps can be
+# run (and cached, timed...) separately.
+def retrieve(questions, tokenizer, retriever, model, n_docs=None, encoded=None):
+    if encoded is None:
+        encoded = encode_questions(questions, tokenizer, model)
+    n_docs = n_docs or model.config.n_docs
+    question_hidden_states = encoded["hidden_states"]
+    with span("retrieve", questions=len(question_hidden_states), n_docs=n_docs), torch.no_grad():
+        docs = retriever(encoded["input_ids"].numpy(), question_hidden_states.numpy(), n_docs=n_docs,
+                         return_tensors="pt")
+        doc_scores = torch.bmm(question_hidden_states.unsqueeze(1),
+                               docs["retrieved_doc_embeds"].float().transpose(1, 2)).squeeze(1)
+    return {
+        "context_input_ids": docs["context_input_ids"],
+        "context_attention_mask": docs["context_attention_mask"],
+        "doc_scores": doc_scores,
+        "doc_ids": docs["doc_ids"],
+        "n_docs": n_docs,
+    }
+
+
+# Function to generate one answer per question from retrieved contexts, in
+# batches of batch_size questions (all at once when batch_size is None)
+def generate_answers(retrieved, tokenizer, model, num_beams=4, max_new_tokens=None, batch_size=None):
+    n_docs = retrieved["n_docs"]
+    n_questions = retrieved["doc_scores"].shape[0]
+    batch_size = batch_size or n_questions
+    generate_kwargs = {"num_beams": num_beams, "num_return_sequences": 1, "n_docs": n_docs}
+    if max_new_tokens:
+        generate_kwargs["max_new_tokens"] = max_new_tokens
+
+    answers = []
+    with torch.no_grad():
+        for start in range(0, n_questions, batch_size):
+            end = min(start + batch_size, n_questions)
+            with span("generate", questions=end - start, num_beams=num_beams):
+                outputs = model.generate(
+                    context_input_ids=retrieved["context_input_ids"][start * n_docs:end * n_docs],
+                    context_attention_mask=retrieved["context_attention_mask"][start * n_docs:end * n_docs],
+                    doc_scores=retrieved["doc_scores"][start:end],
+                    **generate_kwargs,
+                )
+            with span("decode"):
+                answers.extend(a.strip() for a in tokenizer.batch_decode(outputs, skip_special_tokens=True))
+    return answers
+
+
+# Function to split a batched retrieval result into one result per question,
+# trimming context padding that only the longest question in the batch needed
+def split_retrieved(retrieved):
+    n_docs = retrieved["n_docs"]
+    parts = []
+    for i in range(retrieved["doc_scores"].shape[0]):
+        mask = retrieved["context_attention_mask"][i * n_docs:(i + 1) * n_docs]
+        length = int(mask.sum(dim=1).max())
+        parts.append({
+            "context_input_ids": retrieved["context_input_ids"][i * n_docs:(i + 1) * n_docs, :length].clone(),
+            "context_attention_mask": mask[:, :length].clone(),
+            "doc_scores": retrieved["doc_scores"][i:i + 1].clone(),
+            "doc_ids": retrieved["doc_ids"][i:i + 1].clone(),
+            "n_docs": n_docs,
+        })
+    return parts
+
+
+# Function to batch per-question retrieval results again, right-padding the
+# contexts to a common length
+def merge_retrieved(parts, pad_token_id):
+    length = max(part["context_input_ids"].shape[1] for part in parts)
+
+    def padded(part, name, value):
+        tensor = part[name]
+        return torch.nn.functional.pad(tensor, (0, length - tensor.shape[1]), value=value)
+
+    return {
+        "context_input_ids": torch.cat([padded(p, "context_input_ids", pad_token_id) for p in parts]),
+        "context_attention_mask": torch.cat([padded(p, "context_attention_mask", 0) for p in parts]),
+        "doc_scores": torch.cat([p["doc_scores"] for p in parts]),
+        "doc_ids": torch.cat([p["doc_ids"] for p in parts]),
+        "n_docs": parts[0]["n_docs"],
+    }
+
+
+# Function to answer a batch of questions: one tokenization, one retrieval call
+# and batched generation. Questions that only differ in case, punctuation or
+# whitespace are answered once. With an answer cache (see answer_cache.AnswerCache),
+# exact and near-duplicate repeats are answered from the cache; with a
+# retrieval cache (see retrieval_cache.RetrievalCache), questions retrieved
+# before skip retrieval and only go through generation. When a stats dict is
+# given, stats["generated"] is set to the number of questions generated.
+def answer_questions(questions, tokenizer, retriever, model, num_beams=4, n_docs=None, max_new_tokens=None,
+                     batch_size=None, cache=None, retrieval_cache=None, stats=None):
+    unique = {}
+    for question in questions:
+        unique.setdefault(normalize_question(question), question)
+    if len(unique) < len(questions):
+        unique_answers = answer_questions(list(unique.values()), tokenizer, retriever, model, num_beams=num_beams,
+                                          n_docs=n_docs, max_new_tokens=max_new_tokens, batch_size=batch_size,
+                                          cache=cache, retrieval_cache=retrieval_cache, stats=stats)
+        answers = dict(zip(unique, unique_answers))
+        return [answers[normalize_question(question)] for question in questions]
+
+    n_docs = n_docs or model.config.n_docs
+    settings = (num_beams, n_docs, max_new_tokens)
+    answers = [None] * len(questions)
+    if cache is not None:
+        with span("answer cache lookup"):
+            for i, question in enumerate(questions):
+                answers[i] = cache.get_exact(question, settings)
+    pending = [i for i, answer in enumerate(answers) if answer is None]
+    if stats is not None:
+        stats["generated"] = 0
+    if not pending:
+        return answers
+
+    parts = {}
+    if retrieval_cache is not None:
+        for i in pending:
+            part = retrieval_cache.get(questions[i], n_docs)
+            if part is not None:
+                parts[i] = part
+
+    # Questions are encoded for near-duplicate answer lookups and for retrieval
+    to_encode = pending if cache is not None else [i for i in pending if i not in parts]
+    embeddings = {}
+    if to_encode:
+        encoded = encode_questions([questions[i] for i in to_encode], tokenizer, model)
+        embeddings = {i: encoded["hidden_states"][row].numpy() for row, i in enumerate(to_encode)}
+        if cache is not None:
+            for i in to_encode:
+                answers[i] = cache.get(questions[i], settings, embedding=embeddings[i])
+            pending = [i for i in pending if answers[i] is None]
+
+        rows = [row for row, i in enumerate(to_encode) if answers[i] is None and i not in parts]
+        if rows:
+            retrieved = retrieve(None, tokenizer, retriever, model, n_docs=n_docs,
+                                 encoded=select_encoded(encoded, rows))
+            for row, part in zip(rows, split_retrieved(retrieved)):
+                parts[to_encode[row]] = part
+                if retrieval_cache is not None:
+                    retrieval_cache.put(questions[to_encode[row]], n_docs, part)
+    if not pending:
+        return answers
+
+    if stats is not None:
+        stats["generated"] = len(pending)
+    retrieved = merge_retrieved([parts[i] for i in pending], tokenizer.generator.pad_token_id)
+    generated = generate_answers(retrieved, tokenizer, model, num_beams=num_beams, max_new_tokens=max_new_tokens,
+                                 batch_size=batch_size)
+    for i, answer in zip(pending, generated):
+        answers[i] = answer
+        if cache is not None:
+            cache.put(questions[i], answer, settings, embedding=embeddings.get(i))
+    return answers
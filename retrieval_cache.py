@@ -0,0 +1,68 @@
+import os
+import threading
+from collections import OrderedDict
+
+from answer_cache import normalize_question
+
+
+# Function to estimate the memory held by one cached retrieval result
+def retrieval_nbytes(result):
+    return sum(value.element_size() * value.nelement() for value in result.values() if hasattr(value, "nelement"))
+
+
+# LRU cache of retrieval results (context ids, attention masks, doc scores and
+# doc ids) per normalized question and n_docs, bounded both in entries and in
+# bytes. Generation settings are not part of the key, so changing num_beams or
+# the answer length, or regenerating, reuses the retrieved contexts.
+class RetrievalCache:
+    def __init__(self, max_entries=1000, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, question, n_docs):
+        key = (normalize_question(question), n_docs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, question, n_docs, result):
+        key = (normalize_question(question), n_docs)
+        size = retrieval_nbytes(result)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RetrievalCache(
+                max_entries=int(os.environ.get("QA_RETRIEVAL_CACHE_ENTRIES", "1000")),
+                max_bytes=int(os.environ.get("QA_RETRIEVAL_CACHE_MB", "256")) * 1024 * 1024,
+            )
+        return _cache
@@ -0,0 +1,223 @@
+"""
+Retrieval service shared by all Streamlit workers on a host. One process owns
+the (memory-mapped) passage index and answers kNN searches from every app
+worker, coalescing concurrent searches into micro-batches. Workers then only
+hold the RAG question encoder and generator.
+
+    python retrieval_service.py --address /tmp/summ-retrieval.sock
+    RETRIEVAL_SERVICE_ADDRESS=/tmp/summ-retrieval.sock streamlit run app.py
+
+The address is a Unix socket path or host:port. The index is chosen as in
+rag_loader.load_index (DPR_INDEX_PATH or a prepared RAG_INDEX_DIR).
+
+Security: requests are pickled (multiprocessing.connection), so any client
+that passes the authkey handshake can run arbitrary code in the service.
+The Unix socket is only accessible by the user running the service. A TCP
+address is refused unless RETRIEVAL_SERVICE_KEY is set to a secret shared
+with the app workers; even then the traffic is not encrypted, so keep the
+port on a trusted network.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from queue import Empty, Queue
+
+import numpy as np
+from transformers.models.rag.retrieval_rag import Index
+
+logger = logging.getLogger(__name__)
+
+# Key used on Unix sockets when RETRIEVAL_SERVICE_KEY is not set; there the
+# socket file permissions are what keeps other users out
+DEFAULT_AUTHKEY = "summ"
+
+
+# Function to turn "host:port" into a TCP address; anything else is a Unix socket path
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit() and "/" not in address:
+        return host, int(port)
+    return address
+
+
+# Function to get the connection authkey for an address. TCP addresses need
+# RETRIEVAL_SERVICE_KEY: with a well-known key anyone reaching the port could
+# send a crafted pickle.
+def service_authkey(address):
+    key = os.environ.get("RETRIEVAL_SERVICE_KEY")
+    if not key:
+        if not isinstance(parse_address(address), str):
+            raise RuntimeError(f"Set RETRIEVAL_SERVICE_KEY to use the retrieval service over TCP ({address})")
+        key = DEFAULT_AUTHKEY
+    return key.encode("utf-8")
+
+
+# Collects items submitted from many threads and runs them through fn in
+# batches: a batch is started once max_batch items are waiting or the oldest
+# waiting item is max_wait_ms old. fn takes a list of items and returns a list
+# of results in the same order.
+class MicroBatcher:
+    def __init__(self, fn, max_batch=64, max_wait_ms=5.0):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except Empty:
+                    break
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+# Serves searches and passage lookups over one index to any number of clients
+class RetrievalService:
+    def __init__(self, index, max_batch=64, max_wait_ms=5.0):
+        self.index = index
+        self.batcher = MicroBatcher(self._search_batch, max_batch=max_batch, max_wait_ms=max_wait_ms)
+
+    def serve_forever(self, address):
+        authkey = service_authkey(address)
+        # the Unix socket is created accessible by this user only
+        umask = os.umask(0o077)
+        try:
+            listener = Listener(parse_address(address), authkey=authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            logger.info("Retrieval service listening on %s", address)
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning("Rejected connection: %s", e)
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                try:
+                    conn.send(("ok", self._dispatch(request)))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+
+    def _dispatch(self, request):
+        command = request[0]
+        if command == "search":
+            return self.batcher.submit((request[1], request[2]))
+        if command == "docs":
+            return self.index.get_doc_dicts(request[1])
+        if command == "ping":
+            return "pong"
+        raise ValueError(f"Unknown command {command!r}")
+
+    def _search_batch(self, items):
+        # one index search per distinct n_docs over all queued question vectors
+        results = [None] * len(items)
+        by_n_docs = {}
+        for i, (_, n_docs) in enumerate(items):
+            by_n_docs.setdefault(n_docs, []).append(i)
+        for n_docs, positions in by_n_docs.items():
+            queries = np.concatenate([items[i][0] for i in positions]).astype("float32", copy=False)
+            ids, vectors = self.index.get_top_docs(queries, n_docs)
+            start = 0
+            for i in positions:
+                end = start + len(items[i][0])
+                results[i] = (ids[start:end], vectors[start:end])
+                start = end
+        return results
+
+
+# RAG index that forwards searches and passage lookups to a RetrievalService.
+# Each thread keeps its own connection.
+class RemoteIndex(Index):
+    def __init__(self, address):
+        self.address = address
+        self._local = threading.local()
+
+    def is_initialized(self):
+        return True
+
+    def init_index(self):
+        self._call("ping")
+
+    def get_top_docs(self, question_hidden_states, n_docs=5):
+        return self._call("search", np.asarray(question_hidden_states, dtype="float32"), n_docs)
+
+    def get_doc_dicts(self, doc_ids):
+        return self._call("docs", np.asarray(doc_ids))
+
+    def _call(self, *request):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(parse_address(self.address), authkey=service_authkey(self.address))
+        try:
+            conn.send(request)
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            # service restarted; reconnect on the next call
+            self._local.conn = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"Retrieval service error: {result}")
+        return result
+
+
+def main():
+    from transformers import RagConfig
+
+    from rag_loader import RAG_MODEL_NAME, load_index
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", default=os.environ.get("RETRIEVAL_SERVICE_ADDRESS", "/tmp/summ-retrieval.sock"))
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        service_authkey(args.address)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    index = load_index(RagConfig.from_pretrained(RAG_MODEL_NAME), use_service=False)
+    if index is None:
+        raise SystemExit("No local index found: set DPR_INDEX_PATH or run prepare_rag_index.py first.")
+    address = parse_address(args.address)
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)
+    RetrievalService(index, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms).serve_forever(args.address)
+
+
+if __name__ == "__main__":
+    main()
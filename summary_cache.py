@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from chunking import normalize_text
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "summ", "summaries.sqlite")
+
+
+# Function to build a stable key from raw bytes or text plus any parameters that
+# change the cached value (model name, generation settings, page range, ...)
+def content_key(content, **params):
+    digest = hashlib.sha256(content if isinstance(content, bytes) else content.encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Persistent, content-addressed cache for extracted document text, document
+# summaries and per-chunk summaries. Entries live in one SQLite file shared by
+# every session and server process; once the stored values exceed max_bytes the
+# least recently used entries are dropped.
+class SummaryCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, last_access REAL NOT NULL,"
+                " PRIMARY KEY (kind, key))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+
+    def get(self, kind, key):
+        return self.get_many(kind, [key]).get(key)
+
+    def get_many(self, kind, keys):
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock, self._conn:
+            # stay below SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE kind = ? AND key IN ({marks})", [kind] + batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE entries SET last_access = ? WHERE kind = ? AND key = ?",
+                    [(now, kind, key) for key in found],
+                )
+        return found
+
+    def put(self, kind, key, value):
+        self.put_many(kind, {key: value})
+
+    def put_many(self, kind, values):
+        if not values:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (kind, key, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                [(kind, key, value, len(value.encode("utf-8")), now) for key, value in values.items()],
+            )
+            self._evict()
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+
+    def chunk_store(self, **params):
+        return ChunkSummaryStore(self, **params)
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT kind, key, size FROM entries ORDER BY last_access").fetchall()
+        stale = []
+        for kind, key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((kind, key))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE kind = ? AND key = ?", stale)
+
+
+# Per-chunk summaries for one model and set of generation parameters, so that a
+# document sharing chunks with an earlier upload only summarizes the new ones.
+# Chunks are keyed by their normalized text, so whitespace-only differences from
+# re-extraction still hit.
+class ChunkSummaryStore:
+    kind = "chunk"
+
+    def __init__(self, cache, **params):
+        self.cache = cache
+        self.params = params
+
+    def key(self, chunk):
+        return content_key(normalize_text(chunk), **self.params)
+
+    def lookup(self, chunks):
+        keys = [self.key(chunk) for chunk in chunks]
+        found = self.cache.get_many(self.kind, keys)
+        return {i: found[key] for i, key in enumerate(keys) if key in found}
+
+    def store(self, chunks, summaries):
+        self.cache.put_many(self.kind, {self.key(c): s for c, s in zip(chunks, summaries)})
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_summary_cache(path=None, max_bytes=None):
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            path = path or os.environ.get("SUMM_CACHE_PATH", DEFAULT_CACHE_PATH)
+            max_mb = int(os.environ.get("SUMM_CACHE_MAX_MB", "512"))
+            _cache = SummaryCache(path, max_bytes=max_bytes or max_mb * 1024 * 1024)
+        return _cache
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app modules live at the top of the repository and the DPR code in DPR-main
+for path in (ROOT, os.path.join(ROOT, "DPR-main")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+import answer_cache  # noqa: E402
+from answer_cache import AnswerCache, normalize_question  # noqa: E402
+
+
+def test_normalize_question():
+    assert normalize_question("  Who wrote  Hamlet?") == normalize_question("who wrote hamlet")
+
+
+def test_exact_hits_ignore_case_and_punctuation():
+    cache = AnswerCache()
+    cache.put("Who wrote Hamlet?", "Shakespeare", settings=(4, 5, None))
+    assert cache.get("who wrote hamlet", settings=(4, 5, None)) == "Shakespeare"
+    assert cache.get_exact("Who wrote Hamlet", settings=(4, 5, None)) == "Shakespeare"
+    # answers are only reused for the same generation settings
+    assert cache.get("Who wrote Hamlet?", settings=(1, 5, None)) is None
+    assert cache.stats()["exact_hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = AnswerCache(ttl_seconds=60)
+    cache.put("q", "a")
+    now[0] += 59
+    assert cache.get("q") == "a"
+    now[0] += 2
+    assert cache.get("q") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_dropped():
+    cache = AnswerCache(max_entries=2)
+    cache.put("one", "1")
+    cache.put("two", "2")
+    assert cache.get("one") == "1"
+    cache.put("three", "3")
+    assert cache.get("two") is None
+    assert cache.get("one") == "1" and cache.get("three") == "3"
+
+
+def test_near_duplicates_are_found_by_embedding():
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.put("Who wrote Hamlet?", "Shakespeare", embedding=np.array([1.0, 0.0, 0.0]))
+    assert cache.get("Hamlet was written by whom?", embedding=np.array([0.99, 0.05, 0.0])) == "Shakespeare"
+    assert cache.get("Who painted the Mona Lisa?", embedding=np.array([0.0, 1.0, 0.0])) is None
+    assert cache.stats()["similar_hits"] == 1
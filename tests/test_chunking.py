@@ -0,0 +1,81 @@
+from chunking import _iter_sentences, iter_chunks, pack_texts, split_sentences
+
+
+# Whitespace tokenizer with the parts of the transformers tokenizer API the
+# chunker uses: one token per word
+class WordTokenizer:
+    def __call__(self, texts, add_special_tokens=False):
+        if isinstance(texts, str):
+            return {"input_ids": texts.split()}
+        return {"input_ids": [text.split() for text in texts]}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(ids)
+
+
+def test_sentence_across_page_break_is_joined():
+    groups = list(_iter_sentences(["First one. Second starts", "and ends here. Third."]))
+    assert [s for group in groups for s in group] == ["First one.", "Second starts and ends here.", "Third."]
+
+
+def test_tail_without_sentence_ends_is_bounded():
+    pages = ["cell {} | value {} | ".format(i, i) * 20 for i in range(200)]
+    groups = list(_iter_sentences(pages, max_tail_chars=1000))
+    assert len(groups) > 1
+    assert max(len(s) for group in groups for s in group) <= 1000 + max(len(p) for p in pages) + 1
+    assert " ".join(s for group in groups for s in group).split() == " ".join(pages).split()
+
+
+def test_iter_chunks_on_text_without_sentence_ends():
+    pages = ["cell {} | value {} | ".format(i, i) * 50 for i in range(100)]
+    chunks = list(iter_chunks(pages, WordTokenizer(), 64))
+    assert all(len(chunk.split()) <= 64 for chunk in chunks)
+    assert " ".join(chunks).split() == " ".join(pages).split()
+
+
+def test_split_sentences():
+    text = 'One. "Two!" Three? (Four.")  \n\nFive\n\n  six'
+    assert split_sentences(text) == ["One.", '"Two!"', "Three?", '(Four.")', "Five", "six"]
+    assert split_sentences("  \n\n ") == []
+
+
+def test_pack_texts_respects_token_budget():
+    texts = ["a b c", "d e", "f g h i", "j", "k l m n o p"]
+    chunks = pack_texts(texts, WordTokenizer(), 6)
+    assert chunks == ["a b c d e", "f g h i j", "k l m n o p"]
+    assert all(len(chunk.split()) <= 6 for chunk in chunks)
+
+
+def test_pack_texts_max_items_and_long_texts():
+    tokenizer = WordTokenizer()
+    assert pack_texts(["a", "b", "c", "d", "e"], tokenizer, 100, max_items=2) == ["a b", "c d", "e"]
+    # a text over the budget is split on tokens
+    assert pack_texts(["x", "1 2 3 4 5 6 7"], tokenizer, 3) == ["x", "1 2 3", "4 5 6", "7"]
+
+
+def _document(n_sentences):
+    return " ".join("Sentence {} of the report talks about topic {}.".format(i, i % 7) for i in range(n_sentences))
+
+
+def test_content_defined_boundaries_survive_an_insertion():
+    tokenizer = WordTokenizer()
+    text = _document(300)
+    edited = "An extra sentence was added at the top. " + text
+    before = list(iter_chunks([text], tokenizer, 60, content_defined=True))
+    after = list(iter_chunks([edited], tokenizer, 60, content_defined=True))
+    # only the chunks around the edit change
+    assert len(set(before) - set(after)) <= 2
+    assert before[-5:] == after[-5:]
+
+    fixed_before = list(iter_chunks([text], tokenizer, 60))
+    fixed_after = list(iter_chunks([edited], tokenizer, 60))
+    assert len(set(fixed_before) & set(fixed_after)) < len(set(before) & set(after))
+
+
+def test_chunks_do_not_depend_on_page_breaks():
+    tokenizer = WordTokenizer()
+    text = _document(100)
+    words = text.split(" ")
+    # pages end between words, in the middle of sentences
+    pages = [" ".join(words[i:i + 23]) for i in range(0, len(words), 23)]
+    assert list(iter_chunks(pages, tokenizer, 40)) == list(iter_chunks([text], tokenizer, 40))
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from dpr.indexer.id_mapping import HEADER, INT_IDS, MAGIC, PREFIXED_INT_IDS, STR_IDS, IdMapping, is_id_mapping_file
+
+
+@pytest.mark.parametrize(
+    "db_ids, kind",
+    [
+        ([3, 1, 2], INT_IDS),
+        ([np.int64(7), 8], INT_IDS),
+        (["wiki:10", "wiki:2", "wiki:0"], PREFIXED_INT_IDS),
+        (["doc-a", "doc-ab", "doc-abc", "other", "wiki:01"] + ["title {}".format(i) for i in range(40)], STR_IDS),
+        (["é", "éa", "x"], STR_IDS),
+    ],
+)
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(tmp_path, db_ids, kind, mmap):
+    mapping = IdMapping.from_list(db_ids)
+    assert mapping.kind == kind
+    path = str(tmp_path / "index_meta.dpr")
+    mapping.save(path)
+    assert is_id_mapping_file(path)
+    loaded = IdMapping.load(path, mmap=mmap)
+    assert loaded.kind == kind
+    assert list(loaded) == list(db_ids)
+
+
+def test_load_version_1_string_file(tmp_path):
+    # version 1 stored every string whole, without shared prefix lengths
+    db_ids = ["doc-a", "doc-ab", "x"]
+    encoded = [db_id.encode("utf-8") for db_id in db_ids]
+    offsets = np.cumsum([0] + [len(e) for e in encoded]).astype("<i8")
+    blob = b"".join(encoded)
+    path = tmp_path / "index_meta.dpr"
+    path.write_bytes(HEADER.pack(MAGIC, 1, STR_IDS, len(db_ids), len(blob)) + offsets.tobytes() + blob)
+    loaded = IdMapping.load(str(path))
+    assert list(loaded) == db_ids
+    assert loaded.translate([[2, -1]]) == [["x", None]]
+
+
+@pytest.mark.parametrize("db_ids", [[10, 20, 30], ["wiki:1", "wiki:2", "wiki:3"], ["a", "b", "c"]])
+def test_translate_marks_missing_results(db_ids):
+    mapping = IdMapping.from_list(db_ids)
+    assert mapping.translate(np.array([[2, 0, -1], [1, -1, -1]])) == [
+        [db_ids[2], db_ids[0], None],
+        [db_ids[1], None, None],
+    ]
+
+
+@pytest.mark.parametrize("db_ids", [[("wiki", 1)], [1, "wiki:2"], [1.5], [True]])
+def test_unsupported_ids_are_refused(db_ids):
+    with pytest.raises(TypeError):
+        IdMapping.from_list(db_ids)
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "index_meta.dpr"
+    path.write_bytes(b"\x80\x04pickled" + b"\0" * HEADER.size)
+    assert not is_id_mapping_file(str(path))
+    with pytest.raises(ValueError):
+        IdMapping.load(str(path))
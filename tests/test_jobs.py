@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobExecutor, QueueFullError
+
+
+def wait(executor, job_id):
+    job = executor.get(job_id)
+    for _ in range(500):
+        if job.status in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_submit_reattaches_to_queued_and_finished_jobs():
+    executor = JobExecutor(max_workers=1)
+    release = threading.Event()
+    runs = []
+
+    def work(job, value):
+        release.wait(5)
+        runs.append(value)
+        return value * 2
+
+    blocker = executor.submit("blocker", work, 0)
+    queued = executor.submit("doc", work, 1)
+    assert executor.get(queued).status == "queued"
+    assert executor.submit("doc", work, 1) == queued
+    release.set()
+    assert wait(executor, queued).result == 2
+    assert executor.submit("doc", work, 1) == queued
+    wait(executor, blocker)
+    assert runs == [0, 1]
+
+
+def test_queue_full():
+    executor = JobExecutor(max_workers=1, max_pending=1)
+    release = threading.Event()
+    executor.submit("a", lambda job: release.wait(5))
+    with pytest.raises(QueueFullError):
+        executor.submit("b", lambda job: None)
+    release.set()
+
+
+def test_failed_job_is_retried():
+    executor = JobExecutor(max_workers=1)
+    attempts = []
+
+    def flaky(job):
+        attempts.append(job.id)
+        if len(attempts) == 1:
+            raise ValueError("model not ready")
+        return "summary"
+
+    first = wait(executor, executor.submit("doc", flaky))
+    assert first.status == "failed" and first.error == "model not ready"
+    second = wait(executor, executor.submit("doc", flaky))
+    assert second.id != first.id
+    assert second.status == "done" and second.result == "summary"
+
+
+def test_partials_are_visible_in_snapshot():
+    executor = JobExecutor(max_workers=1)
+
+    def work(job):
+        job.add_partial("first")
+        job.add_partial("second")
+        return "done"
+
+    state = wait(executor, executor.submit("doc", work)).snapshot()
+    assert state["partials"] == ["first", "second"] and state["done_units"] == 2
@@ -0,0 +1,49 @@
+from latency_budget import SETTINGS_LADDER, LatencyBudget, QASettings
+
+
+def record(budget, settings, seconds, n=20):
+    samples = budget._samples[settings]
+    samples.extend([seconds] * n)
+
+
+def test_without_samples_the_cheapest_setting_is_used():
+    assert LatencyBudget().choose(10.0) == SETTINGS_LADDER[-1]
+
+
+def test_best_setting_within_target_is_chosen():
+    budget = LatencyBudget()
+    best, second = SETTINGS_LADDER[:2]
+    record(budget, best, 2.0)
+    record(budget, second, 1.0)
+    assert budget.choose(2.5) == best
+    assert budget.choose(1.5) == second
+    assert budget.choose(0.1) == SETTINGS_LADDER[-1]
+
+
+def test_unmeasured_settings_are_extrapolated_by_cost():
+    budget = LatencyBudget()
+    record(budget, QASettings(5, 4, 64), 1.0)
+    assert budget.estimate_p95(QASettings(10, 4, 64)) == 2.0
+    assert budget.estimate_p95(QASettings(5, 1, 32)) == 0.125
+
+
+def test_requests_in_flight_scale_the_estimates():
+    budget = LatencyBudget()
+    best = SETTINGS_LADDER[0]
+    record(budget, best, 1.0)
+    for settings in SETTINGS_LADDER[1:]:
+        record(budget, settings, 0.2)
+    assert budget.choose(1.5) == best
+    with budget.track(best):
+        assert budget.choose(1.5) == SETTINGS_LADDER[1]
+
+
+def test_track_records_per_question_and_skips_cache_only_requests():
+    budget = LatencyBudget()
+    settings = SETTINGS_LADDER[0]
+    with budget.track(settings, 0):
+        pass
+    assert budget.estimate_p95(settings) is None
+    with budget.track(settings, 0) as sample:
+        sample["n_questions"] = 4
+    assert len(budget._samples[settings]) == 1
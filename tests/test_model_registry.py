@@ -0,0 +1,56 @@
+import threading
+
+from model_registry import ModelRegistry
+
+
+def make_registry(max_models):
+    loads = []
+
+    def loader(task, model, dtype):
+        loads.append(model)
+        return object()
+
+    return ModelRegistry(max_models=max_models, loader=loader), loads
+
+
+def test_get_reuses_loaded_model():
+    registry, loads = make_registry(2)
+    assert registry.get("qa", "a") is registry.get("qa", "a")
+    assert loads == ["a"]
+
+
+def test_least_recently_used_model_is_evicted():
+    registry, loads = make_registry(2)
+    registry.get("qa", "a")
+    registry.get("qa", "b")
+    registry.get("qa", "a")
+    registry.get("qa", "c")
+    assert [m["model"] for m in registry.loaded()] == ["a", "c"]
+    assert ("qa", "b", "float32") not in registry._key_locks
+
+
+def test_use_loads_once_when_all_other_models_are_in_use():
+    registry, loads = make_registry(1)
+    with registry.use("qa", "a"):
+        with registry.use("qa", "b"):
+            # over capacity while both are held
+            assert [m["refs"] for m in registry.loaded()] == [1, 1]
+        assert [m["model"] for m in registry.loaded()] == ["a"]
+    assert loads == ["a", "b"]
+
+
+def test_model_in_use_is_not_unloaded():
+    registry, _ = make_registry(2)
+    with registry.use("qa", "a"):
+        assert not registry.unload("qa", "a")
+    assert registry.unload("qa", "a")
+
+
+def test_concurrent_get_loads_once():
+    registry, loads = make_registry(2)
+    threads = [threading.Thread(target=registry.get, args=("qa", "a")) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert loads == ["a"]
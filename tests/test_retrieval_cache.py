@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("faiss")
+
+from retrieval_cache import RetrievalCache, retrieval_nbytes  # noqa: E402
+
+
+# Stands in for a tensor of the retrieval result: nbytes bytes of int8
+class FakeTensor:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def element_size(self):
+        return 1
+
+    def nelement(self):
+        return self.nbytes
+
+
+def result(nbytes):
+    return {"context_input_ids": FakeTensor(nbytes), "n_docs": 5}
+
+
+def test_nbytes_counts_tensors_only():
+    assert retrieval_nbytes(result(100)) == 100
+
+
+def test_hits_ignore_question_formatting():
+    cache = RetrievalCache()
+    part = result(10)
+    cache.put("Who wrote Hamlet?", 5, part)
+    assert cache.get("who wrote hamlet", 5) is part
+    assert cache.get("who wrote hamlet", 10) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_cache_is_bounded_in_bytes():
+    cache = RetrievalCache(max_bytes=100)
+    cache.put("a", 5, result(40))
+    cache.put("b", 5, result(40))
+    assert cache.get("a", 5) is not None
+    cache.put("c", 5, result(40))
+    # "b" was the least recently used entry
+    assert cache.get("b", 5) is None
+    assert cache.stats()["bytes"] == 80
+    # a result larger than the whole cache is not stored
+    cache.put("d", 5, result(101))
+    assert cache.get("d", 5) is None and cache.stats()["entries"] == 2
+
+
+def test_replacing_an_entry_updates_the_size():
+    cache = RetrievalCache(max_bytes=100)
+    cache.put("a", 5, result(40))
+    cache.put("a", 5, result(60))
+    assert cache.stats() == {"entries": 1, "bytes": 60, "hits": 0, "misses": 0}
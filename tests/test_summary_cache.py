@@ -0,0 +1,46 @@
+import itertools
+
+import pytest
+
+import summary_cache
+from summary_cache import SummaryCache, content_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # one tick per call, so that every access has its own last_access
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(summary_cache.time, "time", lambda: float(next(ticks)))
+
+
+def test_content_key_depends_on_content_and_params():
+    assert content_key(b"abc", model="t5") == content_key("abc", model="t5")
+    assert content_key(b"abc", model="t5") != content_key(b"abc", model="bart")
+    assert content_key(b"abc", a=1, b=2) == content_key(b"abc", b=2, a=1)
+
+
+def test_get_many_and_put_many(tmp_path):
+    cache = SummaryCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many("summary", {"a": "first", "b": "second"})
+    assert cache.get_many("summary", ["a", "b", "c", "a"]) == {"a": "first", "b": "second"}
+    assert cache.get("text", "a") is None
+
+
+def test_least_recently_used_entries_are_evicted_by_size(tmp_path, clock):
+    cache = SummaryCache(str(tmp_path / "cache.sqlite"), max_bytes=30)
+    cache.put("summary", "a", "x" * 10)
+    cache.put("summary", "b", "y" * 10)
+    cache.put("summary", "c", "z" * 10)
+    # reading "a" makes "b" the least recently used entry
+    assert cache.get("summary", "a") == "x" * 10
+    cache.put("summary", "d", "w" * 10)
+    assert cache.get_many("summary", ["a", "b", "c", "d"]).keys() == {"a", "c", "d"}
+    assert cache.size() == 30
+
+
+def test_chunk_store_ignores_whitespace_differences(tmp_path):
+    cache = SummaryCache(str(tmp_path / "cache.sqlite"))
+    store = cache.chunk_store(model="t5")
+    store.store(["First chunk.", "Second  chunk."], ["one", "two"])
+    assert store.lookup(["New chunk.", "Second\nchunk."]) == {1: "two"}
+    assert cache.chunk_store(model="bart").lookup(["First chunk."]) == {}
@@ -0,0 +1,53 @@
+import json
+
+from tracing import Span, Trace, TraceExporter, format_waterfall, span
+
+
+def make_trace(spans, duration):
+    trace = Trace("summarization")
+    trace._spans = [Span(name, depth, start, length, memory, {}) for name, depth, start, length, memory in spans]
+    trace.duration = duration
+    return trace
+
+
+def test_format_waterfall():
+    trace = make_trace([
+        ("extraction", 0, 0.0, 0.5, 2 * 2 ** 20),
+        ("page", 1, 0.0, 0.25, 0),
+        ("inference", 0, 0.5, 0.5, -2 ** 20),
+    ], 1.0)
+    lines = format_waterfall(trace, width=10).splitlines()
+    assert lines == [
+        "extraction               |#####     |    500.0 ms    +2.0 MB",
+        "  page                   |##        |    250.0 ms    +0.0 MB",
+        "inference                |     #####|    500.0 ms    -1.0 MB",
+        "total                    |          |   1000.0 ms",
+    ]
+
+
+def test_format_waterfall_of_empty_trace():
+    assert format_waterfall(make_trace([], None), width=4) == "total                    |    |      0.0 ms"
+
+
+def test_spans_nest_and_need_an_active_trace():
+    with span("ignored"):
+        pass
+    trace = Trace("qa")
+    with trace.span("outer"):
+        with trace.span("inner"):
+            pass
+    assert [(s.name, s.depth) for s in trace.spans()] == [("outer", 0), ("inner", 1)]
+
+
+def test_exporters(tmp_path):
+    trace = make_trace([("encode", 0, 0.0, 0.25, 100)], 0.5)
+    jsonl = TraceExporter(str(tmp_path / "traces.jsonl"))
+    jsonl.export(trace)
+    assert json.loads((tmp_path / "traces.jsonl").read_text())["spans"][0]["name"] == "encode"
+
+    prometheus = TraceExporter(str(tmp_path / "summ.prom"), format="prometheus")
+    prometheus.export(trace)
+    prometheus.export(trace)
+    text = (tmp_path / "summ.prom").read_text()
+    assert 'summ_span_seconds_count{trace="summarization",span="encode"} 2' in text
+    assert 'summ_span_memory_delta_bytes_sum{trace="summarization",span="encode"} 200' in text
@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+# One timed stage of a request: offset from the start of the trace and duration
+# in seconds, change of the process RSS in bytes, and nesting depth
+Span = namedtuple("Span", ["name", "depth", "start", "duration", "memory_delta", "attrs"])
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# Function to read the resident set size of this process in bytes (0 where
+# /proc is not available)
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+# Spans recorded while serving one request. A trace may be handed from the page
+# to a background job; spans can be read from another thread while it runs.
+class Trace:
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.created = time.time()
+        self.duration = None
+        self._origin = time.perf_counter()
+        self._spans = []
+        self._depth = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        depth = getattr(self._depth, "value", 0)
+        self._depth.value = depth + 1
+        memory = rss_bytes()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self._depth.value = depth
+            stage = Span(name, depth, start - self._origin, duration, rss_bytes() - memory, attrs)
+            with self._lock:
+                self._spans.append(stage)
+
+    def spans(self):
+        with self._lock:
+            return sorted(self._spans, key=lambda stage: (stage.start, stage.depth))
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._origin
+        return self
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "created": self.created,
+            "duration": self.duration,
+            "spans": [stage._asdict() for stage in self.spans()],
+        }
+
+
+_active = threading.local()
+
+
+# Function to make a trace the current one of this thread, so that span() calls
+# in the code it runs are recorded into it
+@contextmanager
+def activate(trace):
+    previous = getattr(_active, "trace", None)
+    _active.trace = trace
+    try:
+        yield trace
+    finally:
+        _active.trace = previous
+
+
+def current_trace():
+    return getattr(_active, "trace", None)
+
+
+# Function to time a stage into the current trace; does nothing without one
+@contextmanager
+def span(name, **attrs):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    with trace.span(name, **attrs):
+        yield
+
+
+# Function to record each item pulled from an iterator (e.g. each batch of PDF
+# pages) as a span of the current trace
+def traced_iter(items, name, **attrs):
+    items = iter(items)
+    while True:
+        with span(name, **attrs):
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+        yield item
+
+
+# Function to draw the spans of a trace as a text waterfall, one line per span
+def format_waterfall(trace, width=30):
+    stages = trace.spans()
+    total = trace.duration or max((stage.start + stage.duration for stage in stages), default=0.0)
+    scale = width / total if total > 0 else 0.0
+    lines = []
+    for stage in stages:
+        offset = min(int(stage.start * scale), width - 1)
+        bar = max(1, int(stage.duration * scale))
+        name = ("  " * stage.depth + stage.name)[:24]
+        timeline = (" " * offset + "#" * bar).ljust(width)[:width]
+        lines.append(f"{name:<24} |{timeline}| {stage.duration * 1000:8.1f} ms {stage.memory_delta / 2 ** 20:+7.1f} MB")
+    lines.append(f"{'total':<24} |{' ' * width}| {total * 1000:8.1f} ms")
+    return "\n".join(lines)
+
+
+# Writes finished traces to a local file: one JSON object per trace ("jsonl"),
+# or per (trace, span) totals in the Prometheus text format ("prometheus"),
+# rewritten on every export so a node exporter textfile collector can scrape it
+class TraceExporter:
+    def __init__(self, path, format="jsonl"):
+        if format not in ("jsonl", "prometheus"):
+            raise ValueError(f"Unknown trace export format {format!r}")
+        self.path = path
+        self.format = format
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        trace.finish()
+        with self._lock:
+            if self.format == "jsonl":
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+                return
+            self._add(trace.name, "request", trace.duration, 0)
+            for stage in trace.spans():
+                self._add(trace.name, stage.name, stage.duration, stage.memory_delta)
+            self._write_prometheus()
+
+    def _add(self, trace_name, span_name, seconds, memory_delta):
+        totals = self._totals.setdefault((trace_name, span_name), [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += memory_delta
+
+    def _write_prometheus(self):
+        lines = [
+            "# HELP summ_span_seconds Time spent in each traced stage of a request.",
+            "# TYPE summ_span_seconds summary",
+        ]
+        for (trace_name, span_name), (count, seconds, _) in sorted(self._totals.items()):
+            labels = f'trace="{trace_name}",span="{span_name}"'
+            lines.append(f"summ_span_seconds_sum{{{labels}}} {seconds:.6f}")
+            lines.append(f"summ_span_seconds_count{{{labels}}} {count}")
+        lines += [
+            "# HELP summ_span_memory_delta_bytes Change of the process RSS over each traced stage.",
+            "# TYPE summ_span_memory_delta_bytes summary",
+        ]
+        for (trace_name, span_name), (count, _, memory_delta) in sorted(self._totals.items()):
+            labels = f'trace="{trace_name}",span="{span_name}"'
+            lines.append(f"summ_span_memory_delta_bytes_sum{{{labels}}} {memory_delta}")
+            lines.append(f"summ_span_memory_delta_bytes_count{{{labels}}} {count}")
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+# Function to get the process-wide exporter; None unless SUMM_TRACE_PATH is set
+def get_trace_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None and os.environ.get("SUMM_TRACE_PATH"):
+            _exporter = TraceExporter(os.environ["SUMM_TRACE_PATH"],
+                                      format=os.environ.get("SUMM_TRACE_FORMAT", "jsonl"))
+        return _exporter
+
+
+# Function to finish a trace and export it when an exporter is configured
+def export_trace(trace):
+    trace.finish()
+    exporter = get_trace_exporter()
+    if exporter is not None:
+        exporter.export(trace)
+    return trace